@@ -1,255 +1,914 @@
 import json
-from typing import Dict, Any, List
-import urllib.request
+import os
+import functools
+import contextvars
+import math
+import string
+import hashlib
+import re
+from collections import OrderedDict
+from functools import lru_cache
+import threading
+from typing import Dict, Any, List, Tuple, Callable, Iterator, Optional
 import urllib.parse
 import time
 
-def search_phone_closed_sources(phone: str) -> List[Dict[str, Any]]:
-    '''Search phone number in closed/leaked databases'''
-    clean_phone = phone.replace('+', '').replace(' ', '').replace('-', '')
-    
-    sources = [
-        {
-            'name': 'Утечки и базы данных',
-            'icon': 'Database',
-            'data': {
-                'GetContact': {
-                    'text': f'Поиск в GetContact - определитель номера',
-                    'url': f'https://getcontact.com/ru/search?number={clean_phone}'
-                },
-                'Truecaller': {
-                    'text': f'Поиск в Truecaller - база номеров',
-                    'url': f'https://www.truecaller.com/search/ru/{clean_phone}'
-                },
-                'NumBuster': {
-                    'text': f'Проверка в NumBuster - база утечек',
-                    'url': f'https://numbuster.com/number/{clean_phone}'
-                }
-            }
-        },
-        {
-            'name': 'Проверка в базах утечек',
-            'icon': 'AlertTriangle',
-            'data': {
-                'LeakCheck': {
-                    'text': f'Проверка номера {phone} в базах утечек',
-                    'url': f'https://leakcheck.net/search?query={phone}'
-                },
-                'HaveIBeenPwned': {
-                    'text': f'Проверка на наличие в утечках данных',
-                    'url': f'https://haveibeenpwned.com/'
-                }
-            }
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+SOURCES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sources.json')
+NUMBERING_PLAN_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'numbering_plan.csv')
+
+# Холодный старт: http.client, concurrent.futures, gzip и реестры грузятся при первом использовании,
+# EAGER_INIT=1 переносит всё это в импорт для заранее прогреваемых экземпляров
+EAGER_INIT = os.environ.get('EAGER_INIT', '0') != '0'
+
+RESPONSE_CACHE_SIZE = int(os.environ.get('RESPONSE_CACHE_SIZE', '1024'))
+# Тело батча собирается в памяти целиком; строка элемента — около 1 КБ, 10 000 элементов — около 10 МБ тела
+BATCH_MAX_ITEMS = int(os.environ.get('BATCH_MAX_ITEMS', '10000'))
+
+PHONE_PATTERN = re.compile(r'\+?[\d\s\-().]{7,24}')
+PHONE_SEPARATORS = re.compile(r'[\s\-().]')
+DEFAULT_COUNTRY_CODE = os.environ.get('DEFAULT_COUNTRY_CODE', '7')
+NATIONAL_NUMBER_LENGTHS = {'1': 10, '7': 10, '375': 9, '380': 9}
+
+TIMING_ENABLED = os.environ.get('TIMING_ENABLED', '1') != '0'
+TIMING_LOG = os.environ.get('TIMING_LOG', '1') != '0'
+HISTOGRAM_BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+# Замеры текущего вызова (свои у каждого из параллельных вызовов) и гистограммы по этапам за время жизни экземпляра
+_metrics_lock = threading.Lock()
+_invocation_metrics: 'contextvars.ContextVar[Optional[Dict[str, Dict[str, float]]]]' = contextvars.ContextVar(
+    'invocation_metrics', default=None
+)
+_stage_histograms: Dict[str, Dict[str, Any]] = {}
+
+class _Stage:
+    '''Adds elapsed wall time of the block to the current invocation stage'''
+    __slots__ = ('name', 'started')
+    
+    def __init__(self, name: str) -> None:
+        self.name = name
+    
+    def __enter__(self) -> '_Stage':
+        self.started = time.perf_counter()
+        return self
+    
+    def __exit__(self, *exc_info: Any) -> bool:
+        elapsed_ms = (time.perf_counter() - self.started) * 1000
+        metrics = _invocation_metrics.get()
+        if metrics is None:
+            return False
+        with _metrics_lock:
+            stages = metrics['stages']
+            stages[self.name] = stages.get(self.name, 0.0) + elapsed_ms
+        return False
+
+class _NoopStage:
+    __slots__ = ()
+    
+    def __enter__(self) -> '_NoopStage':
+        return self
+    
+    def __exit__(self, *exc_info: Any) -> bool:
+        return False
+
+_NOOP_STAGE = _NoopStage()
+
+def stage(name: str) -> Any:
+    '''Context manager timing a handler stage; shared no-op object when timing is disabled'''
+    return _Stage(name) if TIMING_ENABLED else _NOOP_STAGE
+
+def count_call(name: str) -> None:
+    '''Count outbound call for the current invocation'''
+    metrics = _invocation_metrics.get()
+    if metrics is not None:
+        with _metrics_lock:
+            calls = metrics['calls']
+            calls[name] = calls.get(name, 0) + 1
+
+def submit_in_context(pool: Any, fn: Callable[..., Any], *args: Any) -> Any:
+    '''Submit to executor carrying the invocation metrics: pool threads do not inherit contextvars'''
+    return pool.submit(contextvars.copy_context().run, fn, *args)
+
+def observe_stage(name: str, elapsed_ms: float) -> None:
+    '''Add stage duration to in-process histogram (caller holds _metrics_lock)'''
+    histogram = _stage_histograms.get(name)
+    if histogram is None:
+        histogram = _stage_histograms[name] = {'count': 0, 'sum_ms': 0.0, 'buckets': [0] * (len(HISTOGRAM_BUCKETS_MS) + 1)}
+    histogram['count'] += 1
+    histogram['sum_ms'] += elapsed_ms
+    for i, bound in enumerate(HISTOGRAM_BUCKETS_MS):
+        if elapsed_ms <= bound:
+            histogram['buckets'][i] += 1
+            break
+    else:
+        histogram['buckets'][-1] += 1
+
+def dump_metrics() -> Dict[str, Any]:
+    '''Snapshot of stage histograms: count, sum and cumulative buckets keyed by upper bound in ms'''
+    with _metrics_lock:
+        snapshot = {}
+        for name, histogram in _stage_histograms.items():
+            cumulative = 0
+            buckets = {}
+            for bound, bucket_count in zip(list(HISTOGRAM_BUCKETS_MS) + ['+Inf'], histogram['buckets']):
+                cumulative += bucket_count
+                buckets[str(bound)] = cumulative
+            snapshot[name] = {'count': histogram['count'], 'sum_ms': round(histogram['sum_ms'], 3), 'buckets': buckets}
+        return snapshot
+
+def instrumented(function_name: str) -> Callable[[Callable[..., Dict[str, Any]]], Callable[..., Dict[str, Any]]]:
+    '''Wrap handler: Server-Timing header, one structured log line and histograms per invocation'''
+    def decorator(handler_fn: Callable[..., Dict[str, Any]]) -> Callable[..., Dict[str, Any]]:
+        @functools.wraps(handler_fn)
+        def wrapper(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+            if not TIMING_ENABLED:
+                return handler_fn(event, context)
+            
+            metrics: Dict[str, Dict[str, float]] = {'stages': {}, 'calls': {}}
+            token = _invocation_metrics.set(metrics)
+            started = time.perf_counter()
+            try:
+                response = handler_fn(event, context)
+            finally:
+                _invocation_metrics.reset(token)
+            
+            total_ms = (time.perf_counter() - started) * 1000
+            with _metrics_lock:
+                stages = dict(metrics['stages'])
+                calls = dict(metrics['calls'])
+                for name, elapsed_ms in stages.items():
+                    observe_stage(name, elapsed_ms)
+                observe_stage('total', total_ms)
+            
+            timings = [f'{name};dur={elapsed_ms:.2f}' for name, elapsed_ms in stages.items()]
+            timings.append(f'total;dur={total_ms:.2f}')
+            headers = response.setdefault('headers', {})
+            headers['Server-Timing'] = ', '.join(timings)
+            headers['Timing-Allow-Origin'] = '*'
+            
+            if TIMING_LOG:
+                print(json.dumps({
+                    'function': function_name,
+                    'request_id': getattr(context, 'request_id', None),
+                    'status': response.get('statusCode'),
+                    'total_ms': round(total_ms, 3),
+                    'stages_ms': {name: round(elapsed_ms, 3) for name, elapsed_ms in stages.items()},
+                    'calls': calls
+                }), flush=True)
+            return response
+        return wrapper
+    return decorator
+
+COMPRESSION_MIN_BYTES = int(os.environ.get('COMPRESSION_MIN_BYTES', '1024'))
+GZIP_LEVEL = int(os.environ.get('GZIP_LEVEL', '6'))
+BROTLI_QUALITY = int(os.environ.get('BROTLI_QUALITY', '5'))
+
+def dumps(payload: Any) -> str:
+    '''Serialize to compact UTF-8 JSON text, with orjson when it is installed'''
+    if orjson is not None:
+        return orjson.dumps(payload).decode('utf-8')
+    return json.dumps(payload, ensure_ascii=False, separators=(',', ':'))
+
+def parse_fields(spec: Any) -> Optional[Dict[str, Any]]:
+    '''Field projection tree from a list or comma-separated string of dotted paths; None keeps everything
+    Raises: ValueError if spec is not a string or list of strings
+    '''
+    if spec is None:
+        return None
+    if isinstance(spec, str):
+        spec = spec.split(',')
+    if not isinstance(spec, list) or not all(isinstance(path, str) for path in spec):
+        raise ValueError('fields must be a list or comma-separated string of field names')
+    
+    tree: Dict[str, Any] = {}
+    for path in spec:
+        node = tree
+        for key in filter(None, (part.strip() for part in path.split('.'))):
+            node = node.setdefault(key, {})
+    return tree or None
+
+def project(value: Any, tree: Optional[Dict[str, Any]]) -> Any:
+    '''Keep only keys named in projection tree; lists are projected item by item, an empty subtree keeps the value'''
+    if not tree:
+        return value
+    if isinstance(value, list):
+        return [project(item, tree) for item in value]
+    if isinstance(value, dict):
+        return {key: project(value[key], subtree) for key, subtree in tree.items() if key in value}
+    return value
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    '''Pick br (when brotli is installed) or gzip from Accept-Encoding, honoring q=0'''
+    accepted: Dict[str, float] = {}
+    for part in accept_encoding.lower().split(','):
+        name, _, params = part.partition(';')
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip()] = quality
+    
+    for encoding in (('br',) if brotli is not None else ()) + ('gzip',):
+        if accepted.get(encoding, accepted.get('*', 0.0)) > 0:
+            return encoding
+    return None
+
+def compressed(handler_fn: Callable[..., Dict[str, Any]]) -> Callable[..., Dict[str, Any]]:
+    '''Compress text bodies with the encoding negotiated from Accept-Encoding, returned via isBase64Encoded'''
+    @functools.wraps(handler_fn)
+    def wrapper(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+        response = handler_fn(event, context)
+        body = response.get('body')
+        if not body or not isinstance(body, str) or response.get('isBase64Encoded'):
+            return response
+        
+        headers = response.setdefault('headers', {})
+        headers['Vary'] = 'Accept-Encoding'
+        if len(body) < COMPRESSION_MIN_BYTES:
+            return response
+        encoding = negotiate_encoding(get_header(event, 'Accept-Encoding'))
+        if not encoding:
+            return response
+        
+        with stage('compress'):
+            import gzip
+            import base64
+            raw = body.encode('utf-8')
+            data = brotli.compress(raw, quality=BROTLI_QUALITY) if encoding == 'br' else gzip.compress(raw, GZIP_LEVEL, mtime=0)
+            response['body'] = base64.b64encode(data).decode('ascii')
+        response['isBase64Encoded'] = True
+        headers['Content-Encoding'] = encoding
+        return response
+    return wrapper
+
+ADMISSION_RATE = float(os.environ.get('ADMISSION_RATE', '5'))
+ADMISSION_BURST = float(os.environ.get('ADMISSION_BURST', '20'))
+ADMISSION_CLIENTS = int(os.environ.get('ADMISSION_CLIENTS', '10000'))
+MAX_IN_FLIGHT = int(os.environ.get('MAX_IN_FLIGHT', '32'))
+ADMISSION_QUEUE = int(os.environ.get('ADMISSION_QUEUE', '32'))
+ADMISSION_QUEUE_WAIT = float(os.environ.get('ADMISSION_QUEUE_WAIT', '0.25'))
+
+# Допуск запросов: token bucket на клиента (LRU по IP), лимит одновременных и короткая очередь перед ним
+_client_buckets: 'OrderedDict[str, Dict[str, float]]' = OrderedDict()
+_admission_lock = threading.Lock()
+_in_flight = threading.BoundedSemaphore(MAX_IN_FLIGHT)
+_admission_queued = 0
+
+def client_ip(event: Dict[str, Any]) -> str:
+    '''Source IP from platform request context, falling back to the last X-Forwarded-For hop'''
+    source_ip = ((event.get('requestContext') or {}).get('identity') or {}).get('sourceIp')
+    if source_ip:
+        return source_ip
+    # Первые звенья задаёт сам клиент; последнее дописывает прокси платформы
+    return get_header(event, 'X-Forwarded-For').split(',')[-1].strip() or 'unknown'
+
+def take_client_token(client: str) -> float:
+    '''Take one token from client's bucket
+    Returns: 0 if token taken, otherwise seconds until next token is available
+    '''
+    now = time.monotonic()
+    with _admission_lock:
+        bucket = _client_buckets.get(client)
+        if bucket is None:
+            bucket = _client_buckets[client] = {'tokens': ADMISSION_BURST, 'updated': now}
+            while len(_client_buckets) > ADMISSION_CLIENTS:
+                _client_buckets.popitem(last=False)
+        else:
+            _client_buckets.move_to_end(client)
+        bucket['tokens'] = min(ADMISSION_BURST, bucket['tokens'] + (now - bucket['updated']) * ADMISSION_RATE)
+        bucket['updated'] = now
+        if bucket['tokens'] >= 1:
+            bucket['tokens'] -= 1
+            return 0.0
+        return (1 - bucket['tokens']) / ADMISSION_RATE
+
+def acquire_slot() -> bool:
+    '''Take an in-flight slot, waiting in the bounded queue at most ADMISSION_QUEUE_WAIT when all are busy'''
+    global _admission_queued
+    if _in_flight.acquire(blocking=False):
+        return True
+    with _admission_lock:
+        if _admission_queued >= ADMISSION_QUEUE:
+            return False
+        _admission_queued += 1
+    try:
+        return _in_flight.acquire(timeout=ADMISSION_QUEUE_WAIT)
+    finally:
+        with _admission_lock:
+            _admission_queued -= 1
+
+def shed_response(status: int, retry_after: float, error: str) -> Dict[str, Any]:
+    '''Fast rejection with Retry-After in whole seconds'''
+    return {
+        'statusCode': status,
+        'headers': {
+            'Content-Type': 'application/json',
+            'Retry-After': str(max(1, math.ceil(retry_after))),
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Expose-Headers': 'Retry-After'
         },
-        {
-            'name': 'Информация об операторе',
-            'icon': 'Phone',
-            'data': {
-                'NumberingPlans': {
-                    'text': f'Определение оператора и региона для {phone}',
-                    'url': f'https://www.numberingplans.com/?page=analysis&sub=phonenr&phonenr={clean_phone}'
-                },
-                'PhoneInfoga': {
-                    'text': f'Детальная информация о номере',
-                    'url': f'https://sundowndev.github.io/phoneinfoga/'
-                }
-            }
+        'body': json.dumps({'error': error}),
+        'isBase64Encoded': False
+    }
+
+def admission_control(
+    exempt: Optional[Callable[[Dict[str, Any]], bool]] = None
+) -> Callable[[Callable[..., Dict[str, Any]]], Callable[..., Dict[str, Any]]]:
+    '''Wrap handler with per-client rate limit (429) and in-flight limit with bounded queue (503)
+    Args: exempt - predicate for requests that skip the per-client bucket but still take a slot
+    '''
+    def decorator(handler_fn: Callable[..., Dict[str, Any]]) -> Callable[..., Dict[str, Any]]:
+        @functools.wraps(handler_fn)
+        def wrapper(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+            if event.get('httpMethod') == 'OPTIONS':
+                return handler_fn(event, context)
+            
+            if not (exempt and exempt(event)):
+                retry_after = take_client_token(client_ip(event))
+                if retry_after:
+                    count_call('rejected_rate')
+                    return shed_response(429, retry_after, 'Too many requests')
+            
+            with stage('admission'):
+                admitted = acquire_slot()
+            if not admitted:
+                count_call('rejected_overload')
+                return shed_response(503, 1, 'Server is busy')
+            try:
+                return handler_fn(event, context)
+            finally:
+                _in_flight.release()
+        return wrapper
+    return decorator
+
+PROBE_CONCURRENCY = int(os.environ.get('PROBE_CONCURRENCY', '16'))
+PROBE_PER_HOST = int(os.environ.get('PROBE_PER_HOST', '2'))
+PROBE_DEADLINE = float(os.environ.get('PROBE_DEADLINE', '8'))
+PROBE_TIMEOUT = float(os.environ.get('PROBE_TIMEOUT', '5'))
+PROBE_MAX_REDIRECTS = 3
+PROBE_MAX_BODY = 256 * 1024
+PROBE_USER_AGENT = 'Mozilla/5.0 (compatible; osint-search profile probe)'
+PROBE_RULE_DEFAULTS = {
+    'method': 'HEAD',
+    'found_status': [200],
+    'missing_status': [404, 410],
+    'found_text': '',
+    'missing_text': ''
+}
+
+# Общий пул соединений и лимиты на хост для проверки профилей
+_probe_pool: Dict[Tuple[str, str, int], List['http.client.HTTPConnection']] = {}
+_probe_host_limits: Dict[str, threading.BoundedSemaphore] = {}
+_probe_lock = threading.Lock()
+
+# Сериализованные ответы без timestamp, переживают тёплые вызовы
+_response_cache: 'OrderedDict[Tuple[str, str, str], Tuple[str, str]]' = OrderedDict()
+_response_cache_lock = threading.Lock()
+
+QUERY_FIELDS = {
+    'phone': ('phone', 'clean_phone', 'phone_quoted'),
+    'username': ('username',)
+}
+
+def compile_template(template: str, fields: Tuple[str, ...]) -> str:
+    '''Turn text/url template into Python expression of literals and query fields joined with +'''
+    parts = []
+    for literal, field, _, _ in string.Formatter().parse(template):
+        if literal:
+            parts.append(repr(literal))
+        if field is not None:
+            if field not in fields:
+                raise ValueError(f'Unknown field {{{field}}} in template: {template}')
+            parts.append(field)
+    return ' + '.join(parts) or "''"
+
+def compile_renderer(search_type: str, categories: List[Dict[str, Any]]) -> Callable[..., List[Dict[str, Any]]]:
+    '''Generate one function that builds the whole source list for a search type,
+    so per-request work is only string concatenation of the normalized query
+    '''
+    fields = QUERY_FIELDS[search_type]
+    category_exprs = []
+    for category in categories:
+        data_expr = ', '.join(
+            f"{source['key']!r}: {{'text': {compile_template(source['text'], fields)}, "
+            f"'url': {compile_template(source['url'], fields)}}}"
+            for source in category['sources']
+        )
+        category_exprs.append(f"{{'name': {category['name']!r}, 'icon': {category['icon']!r}, 'data': {{{data_expr}}}}}")
+    
+    code = f"def render({', '.join(fields)}):\n    return [{', '.join(category_exprs)}]\n"
+    namespace: Dict[str, Any] = {}
+    exec(compile(code, f'<sources:{search_type}>', 'exec'), namespace)
+    return namespace['render']
+
+def load_registry(path: str) -> Dict[str, Callable[..., List[Dict[str, Any]]]]:
+    '''Load declarative source registry and compile a renderer per search type (open sources first)'''
+    with open(path, encoding='utf-8') as f:
+        raw = json.load(f)
+    
+    return {
+        search_type: compile_renderer(search_type, raw[search_type]['open'] + raw[search_type]['closed'])
+        for search_type in QUERY_FIELDS
+    }
+
+SOURCE_RENDERERS: Optional[Dict[str, Callable[..., List[Dict[str, Any]]]]] = None
+
+def source_renderers() -> Dict[str, Callable[..., List[Dict[str, Any]]]]:
+    '''Compiled source registry, built on first use (a concurrent double build is harmless)'''
+    global SOURCE_RENDERERS
+    if SOURCE_RENDERERS is None:
+        SOURCE_RENDERERS = load_registry(SOURCES_PATH)
+    return SOURCE_RENDERERS
+
+def load_probe_targets(path: str) -> Dict[str, Tuple[Callable[..., List[Tuple[str, str]]], Dict[str, Dict[str, Any]]]]:
+    '''Compile URL renderers and existence rules for sources that declare a probe block
+    Returns: search type -> (render(**values) -> [(source key, url)], source key -> rule)
+    '''
+    with open(path, encoding='utf-8') as f:
+        raw = json.load(f)
+    
+    targets = {}
+    for search_type, fields in QUERY_FIELDS.items():
+        url_exprs = []
+        rules = {}
+        for category in raw[search_type]['open'] + raw[search_type]['closed']:
+            for source in category['sources']:
+                if 'probe' not in source:
+                    continue
+                url_exprs.append(f"({source['key']!r}, {compile_template(source['url'], fields)})")
+                rules[source['key']] = dict(PROBE_RULE_DEFAULTS, **source['probe'])
+        
+        code = f"def render({', '.join(fields)}):\n    return [{', '.join(url_exprs)}]\n"
+        namespace: Dict[str, Any] = {}
+        exec(compile(code, f'<probes:{search_type}>', 'exec'), namespace)
+        targets[search_type] = (namespace['render'], rules)
+    return targets
+
+PROBE_TARGETS: Optional[Dict[str, Tuple[Callable[..., List[Tuple[str, str]]], Dict[str, Dict[str, Any]]]]] = None
+
+def probe_registry() -> Dict[str, Tuple[Callable[..., List[Tuple[str, str]]], Dict[str, Dict[str, Any]]]]:
+    '''Compiled probe targets, built on first probe request'''
+    global PROBE_TARGETS
+    if PROBE_TARGETS is None:
+        PROBE_TARGETS = load_probe_targets(SOURCES_PATH)
+    return PROBE_TARGETS
+
+def load_numbering_plan(path: str) -> Dict[str, Any]:
+    '''Build digit trie from numbering plan table; node info is stored under empty key'''
+    import csv
+    root: Dict[str, Any] = {}
+    with open(path, encoding='utf-8', newline='') as f:
+        for row in csv.DictReader(f):
+            node = root
+            for digit in row['prefix']:
+                node = node.setdefault(digit, {})
+            node[''] = {field: row[field] for field in ('country', 'operator', 'region', 'type') if row[field]}
+    return root
+
+NUMBERING_PLAN: Optional[Dict[str, Any]] = None
+
+def numbering_plan() -> Dict[str, Any]:
+    '''Numbering plan trie, built on first phone lookup'''
+    global NUMBERING_PLAN
+    if NUMBERING_PLAN is None:
+        NUMBERING_PLAN = load_numbering_plan(NUMBERING_PLAN_PATH)
+    return NUMBERING_PLAN
+
+def lookup_prefix(digits: str) -> Tuple[str, Dict[str, str]]:
+    '''Longest-prefix walk over numbering plan trie
+    Returns: (country calling code, merged info where deeper prefixes override shorter)
+    '''
+    node = numbering_plan()
+    country_code = ''
+    info: Dict[str, str] = {}
+    for i, digit in enumerate(digits):
+        node = node.get(digit)
+        if node is None:
+            break
+        entry = node.get('')
+        if entry:
+            if not country_code:
+                country_code = digits[:i + 1]
+            info.update(entry)
+    return country_code, info
+
+@lru_cache(maxsize=4096)
+def normalize_phone(phone: str) -> Dict[str, Any]:
+    '''Parse phone into E.164 and resolve country, operator and region locally
+    Returns: dict with valid flag; e164/countryCode/nationalNumber/country/operator/region/type or error
+    '''
+    text = phone.strip()
+    if not PHONE_PATTERN.fullmatch(text):
+        return {'valid': False, 'error': 'Недопустимый формат номера'}
+    
+    international = text.startswith('+')
+    digits = PHONE_SEPARATORS.sub('', text).lstrip('+')
+    if not international and digits.startswith('00'):
+        digits = digits[2:]
+        international = True
+    
+    if not international:
+        # 8XXXXXXXXXX — национальный формат для +7, 10 цифр — номер без кода страны
+        if len(digits) == 11 and digits[0] == '8':
+            digits = '7' + digits[1:]
+        elif len(digits) == 10:
+            digits = DEFAULT_COUNTRY_CODE + digits
+    
+    if not 8 <= len(digits) <= 15:
+        return {'valid': False, 'error': 'Неверная длина номера'}
+    
+    country_code, info = lookup_prefix(digits)
+    if not country_code:
+        return {'valid': False, 'error': 'Неизвестный код страны'}
+    
+    national_number = digits[len(country_code):]
+    expected_length = NATIONAL_NUMBER_LENGTHS.get(country_code)
+    if expected_length and len(national_number) != expected_length:
+        return {'valid': False, 'error': 'Неверная длина номера'}
+    
+    return {
+        'valid': True,
+        'e164': '+' + digits,
+        'countryCode': country_code,
+        'nationalNumber': national_number,
+        'country': info.get('country', ''),
+        'operator': info.get('operator', ''),
+        'region': info.get('region', ''),
+        'type': info.get('type', '')
+    }
+
+def normalize_phones(phones: List[str]) -> Dict[str, Dict[str, Any]]:
+    '''Normalize a batch of phone numbers, each distinct one once
+    Returns: phone info by input number; bypasses the normalize_phone cache so a large batch does not evict hot numbers
+    '''
+    return {phone: normalize_phone.__wrapped__(phone) for phone in dict.fromkeys(phones)}
+
+def normalize_query(search_type: str, query: str, phone_info: Optional[Dict[str, Any]] = None) -> Dict[str, str]:
+    '''Compute all template values for query once per request
+    Args: phone_info - already normalized phone (batch mode), otherwise normalized here
+    '''
+    if search_type == 'phone':
+        phone_info = phone_info or normalize_phone(query)
+        return {
+            'phone': query,
+            'clean_phone': phone_info['e164'][1:] if phone_info['valid'] else PHONE_SEPARATORS.sub('', query).lstrip('+'),
+            'phone_quoted': urllib.parse.quote(query)
         }
-    ]
-    
-    return sources
-
-def search_phone_osint(phone: str) -> List[Dict[str, Any]]:
-    '''Search phone number in open sources'''
-    # Очищаем номер для использования в URL
-    clean_phone = phone.replace('+', '').replace(' ', '').replace('-', '')
-    
-    sources = [
-        {
-            'name': 'Социальные сети',
-            'icon': 'Users',
-            'data': {
-                'VKontakte': {
-                    'text': f'Поиск по номеру {phone} в ВКонтакте',
-                    'url': f'https://vk.com/search?c[section]=people&c[q]={phone}'
-                },
-                'Telegram': {
-                    'text': f'Telegram аккаунт с номером {phone}',
-                    'url': f'https://t.me/{clean_phone}'
-                },
-                'WhatsApp': {
-                    'text': f'WhatsApp чат с номером {phone}',
-                    'url': f'https://wa.me/{clean_phone}'
-                }
-            }
-        },
-        {
-            'name': 'Мессенджеры',
-            'icon': 'MessageCircle',
-            'data': {
-                'Viber': {
-                    'text': f'Viber: номер {phone}',
-                    'url': f'viber://chat?number={clean_phone}'
-                },
-                'Skype': {
-                    'text': f'Skype поиск по номеру',
-                    'url': f'skype:{clean_phone}?call'
-                }
-            }
-        },
-        {
-            'name': 'Поисковики',
-            'icon': 'Search',
-            'data': {
-                'Google': {
-                    'text': f'Поиск {phone} в Google',
-                    'url': f'https://www.google.com/search?q={urllib.parse.quote(phone)}'
-                },
-                'Yandex': {
-                    'text': f'Поиск {phone} в Яндекс',
-                    'url': f'https://yandex.ru/search/?text={urllib.parse.quote(phone)}'
-                }
-            }
+    return {'username': query.lstrip('@')}
+
+def build_sources(search_type: str, query: str, phone_info: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    '''Render open and closed sources for phone or username from compiled registry'''
+    return source_renderers()[search_type](**normalize_query(search_type, query, phone_info))
+
+def build_response(search_type: str, search_query: str) -> Dict[str, Any]:
+    '''Response body fields without timestamp'''
+    response: Dict[str, Any] = {
+        'success': True,
+        'searchType': search_type,
+        'query': search_query
+    }
+    if search_type == 'phone':
+        with stage('normalize'):
+            response['phoneInfo'] = normalize_phone(search_query)
+    with stage('render'):
+        response['sources'] = build_sources(search_type, search_query)
+    return response
+
+def serialize_response(search_type: str, search_query: str, fields: Optional[Dict[str, Any]] = None) -> str:
+    '''Serialize response body without timestamp, projected to requested fields'''
+    response = build_response(search_type, search_query)
+    with stage('serialize'):
+        return dumps(project(response, fields))
+
+def fields_key(fields: Optional[Dict[str, Any]]) -> str:
+    '''Canonical cache key part for a projection tree'''
+    return json.dumps(fields, sort_keys=True) if fields else ''
+
+def get_cached_response(search_type: str, search_query: str, fields: Optional[Dict[str, Any]] = None) -> Tuple[str, str]:
+    '''Serialized response body (without timestamp) and its ETag from bounded LRU cache'''
+    key = (search_type, search_query, fields_key(fields))
+    with _response_cache_lock:
+        cached = _response_cache.get(key)
+        if cached:
+            _response_cache.move_to_end(key)
+    if cached:
+        count_call('cache_hit')
+        return cached
+    count_call('cache_miss')
+    
+    # Сериализация вне блокировки: параллельный промах по тому же ключу лишь запишет тот же ответ
+    body = serialize_response(search_type, search_query, fields)
+    etag = 'W/"' + hashlib.sha256(body.encode('utf-8')).hexdigest()[:32] + '"'
+    
+    with _response_cache_lock:
+        _response_cache[key] = (body, etag)
+        while len(_response_cache) > RESPONSE_CACHE_SIZE:
+            _response_cache.popitem(last=False)
+    return body, etag
+
+def with_timestamp(body: str, extra: Optional[Dict[str, Any]] = None, fields: Optional[Dict[str, Any]] = None) -> str:
+    '''Append per-request fields and timestamp to cached JSON object body, skipping ones not in projection'''
+    appended = dict(extra or {}, timestamp=int(time.time()))
+    pairs = [f'{dumps(key)}:{dumps(value)}' for key, value in appended.items() if not fields or key in fields]
+    if not pairs:
+        return body
+    separator = ',' if body != '{}' else ''
+    return f'{body[:-1]}{separator}{",".join(pairs)}}}'
+
+def classify_batch_item(item: Any) -> Tuple[str, str]:
+    '''Detect search type of batch item: plain string or {phoneNumber}/{username} object
+    Returns: (search type, stripped query)
+    '''
+    if isinstance(item, dict):
+        if item.get('phoneNumber'):
+            return 'phone', str(item['phoneNumber']).strip()
+        if item.get('username'):
+            return 'username', str(item['username']).strip()
+        raise ValueError('Item must contain phoneNumber or username')
+    
+    if not isinstance(item, str) or not item.strip():
+        raise ValueError('Item must be a non-empty string')
+    
+    query = item.strip()
+    if not query.startswith('@') and PHONE_PATTERN.fullmatch(query):
+        return 'phone', query
+    return 'username', query
+
+def dedup_key(search_type: str, query: str, phone_info: Optional[Dict[str, Any]] = None) -> Tuple[str, str]:
+    '''Normalized identity of query used to drop duplicates within a batch'''
+    if search_type == 'phone':
+        phone_info = phone_info or normalize_phone(query)
+        if not phone_info['valid']:
+            raise ValueError(phone_info['error'])
+        return search_type, phone_info['e164']
+    return search_type, query.lstrip('@').lower()
+
+def build_batch_item(search_type: str, search_query: str, phone_info: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    '''Compact batch line: phone info and one URL per source, without category names and texts'''
+    item: Dict[str, Any] = {
+        'success': True,
+        'searchType': search_type,
+        'query': search_query
+    }
+    if search_type == 'phone':
+        item['phoneInfo'] = phone_info or normalize_phone(search_query)
+    with stage('render'):
+        item['links'] = {
+            key: source['url']
+            for category in build_sources(search_type, search_query, phone_info)
+            for key, source in category['data'].items()
         }
-    ]
-    
-    return sources
-
-def search_username_closed_sources(username: str) -> List[Dict[str, Any]]:
-    '''Search username in closed/leaked databases'''
-    clean_username = username.lstrip('@')
-    
-    sources = [
-        {
-            'name': 'Базы утечек данных',
-            'icon': 'Database',
-            'data': {
-                'LeakCheck': {
-                    'text': f'Поиск @{clean_username} в базах утечек',
-                    'url': f'https://leakcheck.net/search?query={clean_username}'
-                },
-                'Dehashed': {
-                    'text': f'Проверка username в Dehashed',
-                    'url': f'https://dehashed.com/search?query={clean_username}'
-                },
-                'IntelX': {
-                    'text': f'Поиск в Intelligence X (даркнет)',
-                    'url': f'https://intelx.io/?s={clean_username}'
-                }
-            }
-        },
-        {
-            'name': 'OSINT инструменты',
-            'icon': 'Shield',
-            'data': {
-                'Sherlock': {
-                    'text': f'Sherlock - поиск username по 300+ сайтам',
-                    'url': f'https://sherlock-project.github.io/'
-                },
-                'WhatsMyName': {
-                    'text': f'WhatsMyName - проверка занятости username',
-                    'url': f'https://whatsmyname.app/'
-                },
-                'Namechk': {
-                    'text': f'Проверка {clean_username} на всех платформах',
-                    'url': f'https://namechk.com/search/?q={clean_username}'
-                }
-            }
-        },
-        {
-            'name': 'Специализированные базы',
-            'icon': 'Search',
-            'data': {
-                'Pipl': {
-                    'text': f'Поиск персональных данных в закрытых источниках',
-                    'url': f'https://pipl.com/search/?q={clean_username}'
-                },
-                'Spokeo': {
-                    'text': f'Проверка в базе Spokeo (закрытая база США)',
-                    'url': f'https://www.spokeo.com/{clean_username}'
-                }
-            }
+    return item
+
+def iter_batch_lines(items: List[Any], stats: Dict[str, int], fields: Optional[Dict[str, Any]] = None) -> Iterator[str]:
+    '''Yield one NDJSON line per unique identifier; item errors become error lines'''
+    classified: List[Any] = []
+    for item in items:
+        try:
+            classified.append(classify_batch_item(item))
+        except Exception as e:
+            classified.append(e)
+    # Все номера пакета нормализуются одним проходом до сборки строк
+    with stage('normalize'):
+        phone_infos = normalize_phones([c[1] for c in classified if isinstance(c, tuple) and c[0] == 'phone'])
+    
+    seen: set = set()
+    for item, classification in zip(items, classified):
+        try:
+            if isinstance(classification, Exception):
+                raise classification
+            search_type, search_query = classification
+            phone_info = phone_infos.get(search_query) if search_type == 'phone' else None
+            key = dedup_key(search_type, search_query, phone_info)
+            if key in seen:
+                stats['duplicates'] += 1
+                continue
+            seen.add(key)
+            
+            yield with_timestamp(dumps(project(build_batch_item(search_type, search_query, phone_info), fields)), fields=fields)
+        except Exception as e:
+            stats['errors'] += 1
+            yield dumps({'success': False, 'input': item if isinstance(item, (str, dict)) else repr(item), 'error': str(e)})
+
+def batch_response(items: Any, fields: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    '''Build NDJSON response for bulk lookup of mixed phones and usernames'''
+    if not isinstance(items, list) or not items:
+        error: Optional[str] = 'items must be a non-empty array'
+    elif len(items) > BATCH_MAX_ITEMS:
+        error = f'Too many items, maximum is {BATCH_MAX_ITEMS}'
+    else:
+        error = None
+    
+    if error:
+        return {
+            'statusCode': 400,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': json.dumps({'error': error}),
+            'isBase64Encoded': False
         }
-    ]
-    
-    return sources
-
-def search_username_osint(username: str) -> List[Dict[str, Any]]:
-    '''Search username in open sources'''
-    # Очищаем username от @
-    clean_username = username.lstrip('@')
-    
-    sources = [
-        {
-            'name': 'Социальные сети',
-            'icon': 'Users',
-            'data': {
-                'Telegram': {
-                    'text': f'@{clean_username} в Telegram',
-                    'url': f'https://t.me/{clean_username}'
-                },
-                'Instagram': {
-                    'text': f'@{clean_username} в Instagram',
-                    'url': f'https://instagram.com/{clean_username}'
-                },
-                'Twitter/X': {
-                    'text': f'@{clean_username} в Twitter/X',
-                    'url': f'https://twitter.com/{clean_username}'
-                },
-                'VKontakte': {
-                    'text': f'{clean_username} в ВКонтакте',
-                    'url': f'https://vk.com/{clean_username}'
-                },
-                'TikTok': {
-                    'text': f'@{clean_username} в TikTok',
-                    'url': f'https://tiktok.com/@{clean_username}'
-                }
-            }
-        },
-        {
-            'name': 'Профессиональные сети',
-            'icon': 'Briefcase',
-            'data': {
-                'LinkedIn': {
-                    'text': f'{clean_username} в LinkedIn',
-                    'url': f'https://linkedin.com/in/{clean_username}'
-                },
-                'GitHub': {
-                    'text': f'{clean_username} на GitHub',
-                    'url': f'https://github.com/{clean_username}'
-                },
-                'Habr': {
-                    'text': f'{clean_username} на Habr',
-                    'url': f'https://habr.com/ru/users/{clean_username}'
-                }
-            }
+    
+    stats = {'duplicates': 0, 'errors': 0}
+    with stage('batch'):
+        body = '\n'.join(iter_batch_lines(items, stats, fields)) + '\n'
+    
+    return {
+        'statusCode': 200,
+        'headers': {
+            'Content-Type': 'application/x-ndjson',
+            'X-Batch-Received': str(len(items)),
+            'X-Batch-Duplicates': str(stats['duplicates']),
+            'X-Batch-Errors': str(stats['errors']),
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Expose-Headers': 'X-Batch-Received, X-Batch-Duplicates, X-Batch-Errors'
         },
-        {
-            'name': 'Форумы и сообщества',
-            'icon': 'MessageSquare',
-            'data': {
-                'Reddit': {
-                    'text': f'u/{clean_username} на Reddit',
-                    'url': f'https://reddit.com/user/{clean_username}'
-                },
-                'StackOverflow': {
-                    'text': f'{clean_username} на StackOverflow',
-                    'url': f'https://stackoverflow.com/users/{clean_username}'
-                },
-                'YouTube': {
-                    'text': f'@{clean_username} на YouTube',
-                    'url': f'https://youtube.com/@{clean_username}'
-                }
-            }
-        }
-    ]
+        'body': body,
+        'isBase64Encoded': False
+    }
+
+def get_header(event: Dict[str, Any], name: str) -> str:
+    '''Case-insensitive request header lookup'''
+    name = name.lower()
+    for key, value in (event.get('headers') or {}).items():
+        if key.lower() == name:
+            return value or ''
+    return ''
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    '''Weak comparison of If-None-Match header against ETag'''
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    opaque = etag[2:] if etag.startswith('W/') else etag
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate == opaque:
+            return True
+    return False
+
+def _host_limit(host: str) -> threading.BoundedSemaphore:
+    with _probe_lock:
+        if host not in _probe_host_limits:
+            _probe_host_limits[host] = threading.BoundedSemaphore(PROBE_PER_HOST)
+        return _probe_host_limits[host]
+
+def probe_request(method: str, url: str, timeout: float) -> Tuple[int, Dict[str, str], bytes]:
+    '''Single HTTP request over pooled keep-alive connection
+    Returns: (status, lowercased headers, body prefix up to PROBE_MAX_BODY)
+    '''
+    # http.client тянет за собой email.* и ssl, поэтому импортируется только при проверке профилей
+    import http.client
+    
+    parts = urllib.parse.urlsplit(url)
+    scheme = parts.scheme
+    host = parts.hostname or ''
+    port = parts.port or (443 if scheme == 'https' else 80)
+    path = (parts.path or '/') + (f'?{parts.query}' if parts.query else '')
+    key = (scheme, host, port)
+    
+    while True:
+        with _probe_lock:
+            idle = _probe_pool.get(key)
+            conn = idle.pop() if idle else None
+        reused = conn is not None
+        if conn is None:
+            conn_class = http.client.HTTPSConnection if scheme == 'https' else http.client.HTTPConnection
+            conn = conn_class(host, port, timeout=timeout)
+        
+        try:
+            if conn.sock is None:
+                conn.connect()
+            conn.sock.settimeout(timeout)
+            conn.request(method, path, headers={'User-Agent': PROBE_USER_AGENT, 'Accept': '*/*'})
+            response = conn.getresponse()
+            body = response.read(PROBE_MAX_BODY) if method == 'GET' else response.read()
+            break
+        except (http.client.HTTPException, OSError) as e:
+            conn.close()
+            # Протухшее keep-alive соединение из пула пробуем заменить свежим
+            if not reused or isinstance(e, TimeoutError):
+                raise
     
-    return sources
+    # Соединение возвращаем в пул, только если ответ дочитан полностью
+    pooled = False
+    if response.isclosed() and not response.will_close:
+        with _probe_lock:
+            idle = _probe_pool.setdefault(key, [])
+            if len(idle) < PROBE_PER_HOST:
+                idle.append(conn)
+                pooled = True
+    if not pooled:
+        conn.close()
+    
+    return response.status, {k.lower(): v for k, v in response.getheaders()}, body
+
+def classify_probe(rule: Dict[str, Any], status: int, body: bytes, method: str) -> str:
+    '''Apply per-source existence rule to probe response: found, missing or unknown'''
+    if status in rule['missing_status']:
+        return 'missing'
+    if method == 'GET' and status == 200:
+        text = body.decode('utf-8', errors='ignore')
+        if rule['missing_text'] and rule['missing_text'] in text:
+            return 'missing'
+        if rule['found_text']:
+            return 'found' if rule['found_text'] in text else 'missing'
+    if status in rule['found_status']:
+        return 'found'
+    return 'unknown'
+
+def probe_url(url: str, rule: Dict[str, Any], deadline: float) -> Dict[str, Any]:
+    '''HEAD-first existence check with GET fallback and redirect following, bounded by deadline'''
+    started = time.monotonic()
+    method = 'GET' if rule['method'] == 'GET' or rule['found_text'] or rule['missing_text'] else 'HEAD'
+    status = None
+    host = urllib.parse.urlsplit(url).hostname or ''
+    limit = _host_limit(host)
+    
+    if not limit.acquire(timeout=max(0.0, deadline - started)):
+        return {'status': 'unknown', 'httpStatus': None, 'latencyMs': int((time.monotonic() - started) * 1000), 'error': 'timeout'}
+    try:
+        for _ in range(PROBE_MAX_REDIRECTS + 2):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError('deadline exceeded')
+            status, headers, body = probe_request(method, url, min(PROBE_TIMEOUT, remaining))
+            
+            if method == 'HEAD' and status in (403, 405, 501):
+                method = 'GET'
+                continue
+            if 300 <= status < 400 and headers.get('location'):
+                next_url = urllib.parse.urljoin(url, headers['location'])
+                if (urllib.parse.urlsplit(next_url).hostname or '').removeprefix('www.') != host.removeprefix('www.'):
+                    break
+                url = next_url
+                continue
+            break
+        
+        result = {'status': classify_probe(rule, status, body, method), 'httpStatus': status}
+    except Exception as e:
+        result = {'status': 'unknown', 'httpStatus': status, 'error': str(e) or e.__class__.__name__}
+    finally:
+        limit.release()
+    
+    result['latencyMs'] = int((time.monotonic() - started) * 1000)
+    return result
 
+def probe_targets(targets: List[Tuple[str, str, Dict[str, Any]]], deadline_seconds: float = PROBE_DEADLINE) -> Dict[str, Dict[str, Any]]:
+    '''Probe (key, url, rule) targets concurrently; whatever is unfinished at deadline is unknown'''
+    if not targets:
+        return {}
+    
+    from concurrent.futures import ThreadPoolExecutor, wait
+    
+    deadline = time.monotonic() + deadline_seconds
+    pool = ThreadPoolExecutor(max_workers=min(PROBE_CONCURRENCY, len(targets)))
+    futures = {key: submit_in_context(pool, probe_url, url, rule, deadline) for key, url, rule in targets}
+    wait(futures.values(), timeout=deadline_seconds)
+    pool.shutdown(wait=False, cancel_futures=True)
+    
+    results = {}
+    for key, url, _ in targets:
+        future = futures[key]
+        if future.done() and not future.cancelled():
+            results[key] = dict(future.result(), url=url)
+        else:
+            results[key] = {'status': 'unknown', 'httpStatus': None, 'latencyMs': int(deadline_seconds * 1000), 'error': 'timeout', 'url': url}
+    return results
+
+def probe_profiles(search_type: str, query: str) -> Dict[str, Dict[str, Any]]:
+    '''Check whether generated profile URLs exist for query'''
+    render, rules = probe_registry()[search_type]
+    targets = [(key, url, rules[key]) for key, url in render(**normalize_query(search_type, query))]
+    for _ in targets:
+        count_call('probe')
+    with stage('probe'):
+        return probe_targets(targets)
+
+@instrumented('osint-search')
+@admission_control()
+@compressed
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
     Business: Search in open sources (OSINT) by phone or username
-    Args: event - dict with httpMethod, body (phoneNumber/username)
+    Args: event - dict with httpMethod, body (phoneNumber/username, optional probe flag,
+                  or items array for NDJSON batch; optional fields projection), Accept-Encoding header
           context - object with request_id, function_name
     Returns: HTTP response with data from social networks and public sources
     '''
@@ -262,13 +921,24 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type',
+                'Access-Control-Allow-Headers': 'Content-Type, If-None-Match',
                 'Access-Control-Max-Age': '86400'
             },
             'body': '',
             'isBase64Encoded': False
         }
     
+    if method == 'GET' and (event.get('queryStringParameters') or {}).get('metrics'):
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': json.dumps(dump_metrics()),
+            'isBase64Encoded': False
+        }
+    
     if method != 'POST':
         return {
             'statusCode': 405,
@@ -282,6 +952,23 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     
     try:
         body_data = json.loads(event.get('body', '{}'))
+        
+        try:
+            fields = parse_fields(body_data.get('fields'))
+        except ValueError as e:
+            return {
+                'statusCode': 400,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': json.dumps({'error': str(e)}),
+                'isBase64Encoded': False
+            }
+        
+        if 'items' in body_data:
+            return batch_response(body_data['items'], fields)
+        
         phone_number = body_data.get('phoneNumber', '').strip()
         username = body_data.get('username', '').strip()
         
@@ -296,36 +983,59 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'isBase64Encoded': False
             }
         
-        results = []
-        search_type = ''
-        search_query = ''
-        
         if phone_number:
-            open_sources = search_phone_osint(phone_number)
-            closed_sources = search_phone_closed_sources(phone_number)
-            results = open_sources + closed_sources
+            phone_info = normalize_phone(phone_number)
+            if not phone_info['valid']:
+                return {
+                    'statusCode': 400,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*'
+                    },
+                    'body': json.dumps({'error': phone_info['error']}),
+                    'isBase64Encoded': False
+                }
             search_type = 'phone'
             search_query = phone_number
-        elif username:
-            open_sources = search_username_osint(username)
-            closed_sources = search_username_closed_sources(username)
-            results = open_sources + closed_sources
+        else:
             search_type = 'username'
             search_query = username
         
+        body, etag = get_cached_response(search_type, search_query, fields)
+        
+        if body_data.get('probe') and search_type == 'username':
+            # Результаты проверки меняются со временем, поэтому без ETag и кэша
+            return {
+                'statusCode': 200,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': with_timestamp(body, {'probes': probe_profiles(search_type, search_query)}, fields),
+                'isBase64Encoded': False
+            }
+        
+        if etag_matches(get_header(event, 'If-None-Match'), etag):
+            return {
+                'statusCode': 304,
+                'headers': {
+                    'ETag': etag,
+                    'Access-Control-Allow-Origin': '*',
+                    'Access-Control-Expose-Headers': 'ETag'
+                },
+                'body': '',
+                'isBase64Encoded': False
+            }
+        
         return {
             'statusCode': 200,
             'headers': {
                 'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
+                'ETag': etag,
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Expose-Headers': 'ETag'
             },
-            'body': json.dumps({
-                'success': True,
-                'searchType': search_type,
-                'query': search_query,
-                'sources': results,
-                'timestamp': int(time.time())
-            }),
+            'body': with_timestamp(body, fields=fields),
             'isBase64Encoded': False
         }
         
@@ -348,4 +1058,17 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             },
             'body': json.dumps({'error': str(e)}),
             'isBase64Encoded': False
-        }
\ No newline at end of file
+        }
+
+def warm_up() -> None:
+    '''Do at import what lazy paths would otherwise do on the first request'''
+    import gzip  # noqa: F401
+    import base64  # noqa: F401
+    import http.client  # noqa: F401
+    import concurrent.futures  # noqa: F401
+    source_renderers()
+    probe_registry()
+    numbering_plan()
+
+if EAGER_INIT:
+    warm_up()
\ No newline at end of file
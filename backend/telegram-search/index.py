@@ -1,10 +1,24 @@
 import json
 import os
-from typing import Dict, Any, List, Optional
-import urllib.request
+import re
+import functools
+import contextvars
+import math
+from typing import Dict, Any, List, Optional, Tuple, Iterator, Callable
 import urllib.parse
-import urllib.error
 import time
+import threading
+from collections import OrderedDict, deque
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 BOT_TOKENS = [
     '8419757577:AAHL4AeCXoh216ARnFRffjeRtCYePDsPLvE',
@@ -21,87 +35,1205 @@ BOT_CHAT_IDS = {
     BOT_TOKENS[1]: '@VEKTOR_MPFey_Robot'
 }
 
+BOT_CONCURRENCY = max(1, int(os.environ.get('BOT_CONCURRENCY', str(len(BOT_TOKENS)))))
+
+TIMING_ENABLED = os.environ.get('TIMING_ENABLED', '1') != '0'
+TIMING_LOG = os.environ.get('TIMING_LOG', '1') != '0'
+HISTOGRAM_BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+# Замеры текущего вызова (свои у каждого из параллельных вызовов) и гистограммы по этапам за время жизни экземпляра
+_metrics_lock = threading.Lock()
+_invocation_metrics: 'contextvars.ContextVar[Optional[Dict[str, Dict[str, float]]]]' = contextvars.ContextVar(
+    'invocation_metrics', default=None
+)
+_stage_histograms: Dict[str, Dict[str, Any]] = {}
+
+class _Stage:
+    '''Adds elapsed wall time of the block to the current invocation stage'''
+    __slots__ = ('name', 'started')
+    
+    def __init__(self, name: str) -> None:
+        self.name = name
+    
+    def __enter__(self) -> '_Stage':
+        self.started = time.perf_counter()
+        return self
+    
+    def __exit__(self, *exc_info: Any) -> bool:
+        elapsed_ms = (time.perf_counter() - self.started) * 1000
+        metrics = _invocation_metrics.get()
+        if metrics is None:
+            return False
+        with _metrics_lock:
+            stages = metrics['stages']
+            stages[self.name] = stages.get(self.name, 0.0) + elapsed_ms
+        return False
+
+class _NoopStage:
+    __slots__ = ()
+    
+    def __enter__(self) -> '_NoopStage':
+        return self
+    
+    def __exit__(self, *exc_info: Any) -> bool:
+        return False
+
+_NOOP_STAGE = _NoopStage()
+
+def stage(name: str) -> Any:
+    '''Context manager timing a handler stage; shared no-op object when timing is disabled'''
+    return _Stage(name) if TIMING_ENABLED else _NOOP_STAGE
+
+def count_call(name: str) -> None:
+    '''Count outbound call for the current invocation'''
+    metrics = _invocation_metrics.get()
+    if metrics is not None:
+        with _metrics_lock:
+            calls = metrics['calls']
+            calls[name] = calls.get(name, 0) + 1
+
+def submit_in_context(pool: Any, fn: Callable[..., Any], *args: Any) -> Any:
+    '''Submit to executor carrying the invocation metrics: pool threads do not inherit contextvars'''
+    return pool.submit(contextvars.copy_context().run, fn, *args)
+
+def observe_stage(name: str, elapsed_ms: float) -> None:
+    '''Add stage duration to in-process histogram (caller holds _metrics_lock)'''
+    histogram = _stage_histograms.get(name)
+    if histogram is None:
+        histogram = _stage_histograms[name] = {'count': 0, 'sum_ms': 0.0, 'buckets': [0] * (len(HISTOGRAM_BUCKETS_MS) + 1)}
+    histogram['count'] += 1
+    histogram['sum_ms'] += elapsed_ms
+    for i, bound in enumerate(HISTOGRAM_BUCKETS_MS):
+        if elapsed_ms <= bound:
+            histogram['buckets'][i] += 1
+            break
+    else:
+        histogram['buckets'][-1] += 1
+
+def dump_metrics() -> Dict[str, Any]:
+    '''Snapshot of stage histograms: count, sum and cumulative buckets keyed by upper bound in ms'''
+    with _metrics_lock:
+        snapshot = {}
+        for name, histogram in _stage_histograms.items():
+            cumulative = 0
+            buckets = {}
+            for bound, bucket_count in zip(list(HISTOGRAM_BUCKETS_MS) + ['+Inf'], histogram['buckets']):
+                cumulative += bucket_count
+                buckets[str(bound)] = cumulative
+            snapshot[name] = {'count': histogram['count'], 'sum_ms': round(histogram['sum_ms'], 3), 'buckets': buckets}
+        return snapshot
+
+def instrumented(function_name: str) -> Callable[[Callable[..., Dict[str, Any]]], Callable[..., Dict[str, Any]]]:
+    '''Wrap handler: Server-Timing header, one structured log line and histograms per invocation'''
+    def decorator(handler_fn: Callable[..., Dict[str, Any]]) -> Callable[..., Dict[str, Any]]:
+        @functools.wraps(handler_fn)
+        def wrapper(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+            if not TIMING_ENABLED:
+                return handler_fn(event, context)
+            
+            metrics: Dict[str, Dict[str, float]] = {'stages': {}, 'calls': {}}
+            token = _invocation_metrics.set(metrics)
+            started = time.perf_counter()
+            try:
+                response = handler_fn(event, context)
+            finally:
+                _invocation_metrics.reset(token)
+            
+            total_ms = (time.perf_counter() - started) * 1000
+            with _metrics_lock:
+                stages = dict(metrics['stages'])
+                calls = dict(metrics['calls'])
+                for name, elapsed_ms in stages.items():
+                    observe_stage(name, elapsed_ms)
+                observe_stage('total', total_ms)
+            
+            timings = [f'{name};dur={elapsed_ms:.2f}' for name, elapsed_ms in stages.items()]
+            timings.append(f'total;dur={total_ms:.2f}')
+            headers = response.setdefault('headers', {})
+            headers['Server-Timing'] = ', '.join(timings)
+            headers['Timing-Allow-Origin'] = '*'
+            
+            if TIMING_LOG:
+                print(json.dumps({
+                    'function': function_name,
+                    'request_id': getattr(context, 'request_id', None),
+                    'status': response.get('statusCode'),
+                    'total_ms': round(total_ms, 3),
+                    'stages_ms': {name: round(elapsed_ms, 3) for name, elapsed_ms in stages.items()},
+                    'calls': calls
+                }), flush=True)
+            return response
+        return wrapper
+    return decorator
+
+COMPRESSION_MIN_BYTES = int(os.environ.get('COMPRESSION_MIN_BYTES', '1024'))
+GZIP_LEVEL = int(os.environ.get('GZIP_LEVEL', '6'))
+BROTLI_QUALITY = int(os.environ.get('BROTLI_QUALITY', '5'))
+
+def dumps(payload: Any) -> str:
+    '''Serialize to compact UTF-8 JSON text, with orjson when it is installed'''
+    if orjson is not None:
+        return orjson.dumps(payload).decode('utf-8')
+    return json.dumps(payload, ensure_ascii=False, separators=(',', ':'))
+
+def parse_fields(spec: Any) -> Optional[Dict[str, Any]]:
+    '''Field projection tree from a list or comma-separated string of dotted paths; None keeps everything
+    Raises: ValueError if spec is not a string or list of strings
+    '''
+    if spec is None:
+        return None
+    if isinstance(spec, str):
+        spec = spec.split(',')
+    if not isinstance(spec, list) or not all(isinstance(path, str) for path in spec):
+        raise ValueError('fields must be a list or comma-separated string of field names')
+    
+    tree: Dict[str, Any] = {}
+    for path in spec:
+        node = tree
+        for key in filter(None, (part.strip() for part in path.split('.'))):
+            node = node.setdefault(key, {})
+    return tree or None
+
+def project(value: Any, tree: Optional[Dict[str, Any]]) -> Any:
+    '''Keep only keys named in projection tree; lists are projected item by item, an empty subtree keeps the value'''
+    if not tree:
+        return value
+    if isinstance(value, list):
+        return [project(item, tree) for item in value]
+    if isinstance(value, dict):
+        return {key: project(value[key], subtree) for key, subtree in tree.items() if key in value}
+    return value
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    '''Pick br (when brotli is installed) or gzip from Accept-Encoding, honoring q=0'''
+    accepted: Dict[str, float] = {}
+    for part in accept_encoding.lower().split(','):
+        name, _, params = part.partition(';')
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip()] = quality
+    
+    for encoding in (('br',) if brotli is not None else ()) + ('gzip',):
+        if accepted.get(encoding, accepted.get('*', 0.0)) > 0:
+            return encoding
+    return None
+
+def compressed(handler_fn: Callable[..., Dict[str, Any]]) -> Callable[..., Dict[str, Any]]:
+    '''Compress text bodies with the encoding negotiated from Accept-Encoding, returned via isBase64Encoded'''
+    @functools.wraps(handler_fn)
+    def wrapper(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+        response = handler_fn(event, context)
+        body = response.get('body')
+        if not body or not isinstance(body, str) or response.get('isBase64Encoded'):
+            return response
+        
+        headers = response.setdefault('headers', {})
+        headers['Vary'] = 'Accept-Encoding'
+        if len(body) < COMPRESSION_MIN_BYTES:
+            return response
+        encoding = negotiate_encoding(get_header(event, 'Accept-Encoding'))
+        if not encoding:
+            return response
+        
+        with stage('compress'):
+            import gzip
+            import base64
+            raw = body.encode('utf-8')
+            data = brotli.compress(raw, quality=BROTLI_QUALITY) if encoding == 'br' else gzip.compress(raw, GZIP_LEVEL, mtime=0)
+            response['body'] = base64.b64encode(data).decode('ascii')
+        response['isBase64Encoded'] = True
+        headers['Content-Encoding'] = encoding
+        return response
+    return wrapper
+
+ADMISSION_RATE = float(os.environ.get('ADMISSION_RATE', '5'))
+ADMISSION_BURST = float(os.environ.get('ADMISSION_BURST', '20'))
+ADMISSION_CLIENTS = int(os.environ.get('ADMISSION_CLIENTS', '10000'))
+MAX_IN_FLIGHT = int(os.environ.get('MAX_IN_FLIGHT', '8'))
+ADMISSION_QUEUE = int(os.environ.get('ADMISSION_QUEUE', '8'))
+ADMISSION_QUEUE_WAIT = float(os.environ.get('ADMISSION_QUEUE_WAIT', '0.25'))
+
+# Допуск запросов: token bucket на клиента (LRU по IP), лимит одновременных и короткая очередь перед ним
+_client_buckets: 'OrderedDict[str, Dict[str, float]]' = OrderedDict()
+_admission_lock = threading.Lock()
+_in_flight = threading.BoundedSemaphore(MAX_IN_FLIGHT)
+_admission_queued = 0
+
+def client_ip(event: Dict[str, Any]) -> str:
+    '''Source IP from platform request context, falling back to the last X-Forwarded-For hop'''
+    source_ip = ((event.get('requestContext') or {}).get('identity') or {}).get('sourceIp')
+    if source_ip:
+        return source_ip
+    # Первые звенья задаёт сам клиент; последнее дописывает прокси платформы
+    return get_header(event, 'X-Forwarded-For').split(',')[-1].strip() or 'unknown'
+
+def take_client_token(client: str) -> float:
+    '''Take one token from client's bucket
+    Returns: 0 if token taken, otherwise seconds until next token is available
+    '''
+    now = time.monotonic()
+    with _admission_lock:
+        bucket = _client_buckets.get(client)
+        if bucket is None:
+            bucket = _client_buckets[client] = {'tokens': ADMISSION_BURST, 'updated': now}
+            while len(_client_buckets) > ADMISSION_CLIENTS:
+                _client_buckets.popitem(last=False)
+        else:
+            _client_buckets.move_to_end(client)
+        bucket['tokens'] = min(ADMISSION_BURST, bucket['tokens'] + (now - bucket['updated']) * ADMISSION_RATE)
+        bucket['updated'] = now
+        if bucket['tokens'] >= 1:
+            bucket['tokens'] -= 1
+            return 0.0
+        return (1 - bucket['tokens']) / ADMISSION_RATE
+
+def acquire_slot() -> bool:
+    '''Take an in-flight slot, waiting in the bounded queue at most ADMISSION_QUEUE_WAIT when all are busy'''
+    global _admission_queued
+    if _in_flight.acquire(blocking=False):
+        return True
+    with _admission_lock:
+        if _admission_queued >= ADMISSION_QUEUE:
+            return False
+        _admission_queued += 1
+    try:
+        return _in_flight.acquire(timeout=ADMISSION_QUEUE_WAIT)
+    finally:
+        with _admission_lock:
+            _admission_queued -= 1
+
+def shed_response(status: int, retry_after: float, error: str) -> Dict[str, Any]:
+    '''Fast rejection with Retry-After in whole seconds'''
+    return {
+        'statusCode': status,
+        'headers': {
+            'Content-Type': 'application/json',
+            'Retry-After': str(max(1, math.ceil(retry_after))),
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Expose-Headers': 'Retry-After'
+        },
+        'body': json.dumps({'error': error}),
+        'isBase64Encoded': False
+    }
+
+def admission_control(
+    exempt: Optional[Callable[[Dict[str, Any]], bool]] = None
+) -> Callable[[Callable[..., Dict[str, Any]]], Callable[..., Dict[str, Any]]]:
+    '''Wrap handler with per-client rate limit (429) and in-flight limit with bounded queue (503)
+    Args: exempt - predicate for requests that skip the per-client bucket but still take a slot
+    '''
+    def decorator(handler_fn: Callable[..., Dict[str, Any]]) -> Callable[..., Dict[str, Any]]:
+        @functools.wraps(handler_fn)
+        def wrapper(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+            if event.get('httpMethod') == 'OPTIONS':
+                return handler_fn(event, context)
+            
+            if not (exempt and exempt(event)):
+                retry_after = take_client_token(client_ip(event))
+                if retry_after:
+                    count_call('rejected_rate')
+                    return shed_response(429, retry_after, 'Too many requests')
+            
+            with stage('admission'):
+                admitted = acquire_slot()
+            if not admitted:
+                count_call('rejected_overload')
+                return shed_response(503, 1, 'Server is busy')
+            try:
+                return handler_fn(event, context)
+            finally:
+                _in_flight.release()
+        return wrapper
+    return decorator
+
+# Бюджет по умолчанию, если платформа не сообщила оставшееся время
+FUNCTION_TIMEOUT = float(os.environ.get('FUNCTION_TIMEOUT', '30'))
+DEADLINE_RESERVE = float(os.environ.get('DEADLINE_RESERVE', '0.5'))
+
+BOT_ME_TTL = int(os.environ.get('BOT_ME_TTL', '3600'))
+BOT_ME_NEGATIVE_TTL = int(os.environ.get('BOT_ME_NEGATIVE_TTL', '60'))
+BOT_ME_STALE_TTL = int(os.environ.get('BOT_ME_STALE_TTL', '86400'))
+
+# Кэш getMe живёт между тёплыми вызовами функции
+_bot_me_cache: Dict[str, Dict[str, Any]] = {}
+_bot_me_refreshing: set = set()
+_bot_me_lock = threading.Lock()
+
+UPDATE_STORE_PATH = os.environ.get('UPDATE_STORE_PATH', '/tmp/telegram_updates.sqlite3')
+UPDATES_PAGE_SIZE = 100
+UPDATES_MAX_PAGES = int(os.environ.get('UPDATES_MAX_PAGES', '10'))
+UPDATES_LONG_POLL = 30
+RESPONSE_WINDOW = int(os.environ.get('RESPONSE_WINDOW', '900'))
+# Сообщение целиком из username или номера — это запрос, а не ответ бота
+QUERY_MESSAGE_PATTERN = re.compile(r'\s*(?:@\w{1,64}|\+?[\d\s\-().]{7,24})\s*')
+
+# Холодный старт: http.client, sqlite3, concurrent.futures и прочие тяжёлые модули импортируются там,
+# где нужны, и OPTIONS/status/отказы не платят за них; EAGER_INIT=1 грузит их и схему хранилища при импорте
+EAGER_INIT = os.environ.get('EAGER_INIT', '0') != '0'
+
+# polling — getUpdates в каждом поиске; webhook — апдейты пишет входящий вебхук, поиск только читает хранилище
+# (webhook требует UPDATE_STORE_PATH на общем для всех экземпляров хранилище: вебхук попадает в любой экземпляр)
+UPDATE_MODE = os.environ.get('UPDATE_MODE', 'polling')
+WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET', '')
+WEBHOOK_RESPONSE_WAIT = float(os.environ.get('WEBHOOK_RESPONSE_WAIT', '5'))
+WEBHOOK_POLL_INTERVAL = float(os.environ.get('WEBHOOK_POLL_INTERVAL', '0.1'))
+
+# Одинаковые одновременные поиски (бот + нормализованный запрос + max_age) выполняются один раз, остальные ждут результат;
+# max_age в ключе не даёт живому поиску получить ответ из индекса, а cache-first — пропустить свежий индекс.
+# COALESCE_SHARED включает ещё и координацию между процессами через таблицу в общем SQLite-хранилище.
+COALESCE_SHARED = os.environ.get('COALESCE_SHARED', '0') != '0'
+COALESCE_POLL_INTERVAL = float(os.environ.get('COALESCE_POLL_INTERVAL', '0.05'))
+COALESCE_RESULT_GRACE = float(os.environ.get('COALESCE_RESULT_GRACE', '2'))
+
+_flights: Dict[Tuple[str, str, int], Dict[str, Any]] = {}
+_flights_lock = threading.Lock()
+
+# Найденные ответы ботов копятся в полнотекстовом индексе того же хранилища
+CACHE_FIRST = os.environ.get('CACHE_FIRST', '0') != '0'
+RESPONSE_FRESHNESS = int(os.environ.get('RESPONSE_FRESHNESS', '3600'))
+RESPONSE_HISTORY_TTL = int(os.environ.get('RESPONSE_HISTORY_TTL', str(30 * 86400)))
+HISTORY_SEARCH_LIMIT = int(os.environ.get('HISTORY_SEARCH_LIMIT', '50'))
+QUERY_KEY_SEPARATORS = re.compile(r'[\s\-().]')
+
+# Все виды сущностей в одном выражении: один проход finditer по тексту, вид — по имени сработавшей группы.
+# Повторы ограничены сверху, поэтому на любом входе время линейно по длине текста.
+ENTITY_PATTERN = re.compile(
+    # Общий вход: каждая сущность начинается в начале слова или с «+» — внутри слов проверка отсекается сразу
+    r'(?:\b(?=\w)|(?=\+))(?:'
+    r'(?P<link>\bhttps?://[^\s<>"\']{1,2048}|\bt\.me/[\w/+-]{1,256})'
+    r'|(?P<email>(?<![\w.+-])[\w.+-]{1,64}@[\w-]{1,63}(?:\.[\w-]{1,63}){0,8}\.[^\W\d_]{2,24}\b)'
+    r'|(?P<date>\b(?:\d{1,2}[./]\d{1,2}[./](?:19|20)\d{2}|(?:19|20)\d{2}-\d{2}-\d{2})\b)'
+    r'|(?P<phone>(?<![\w+])(?:\+\d(?:[\s\-()]{0,2}\d){9,14}|[78](?:[\s\-()]{0,2}\d){10})(?!\w))'
+    r'|(?:\b(?i:ФИО|Имя|Name)\s{0,4}:[ \t]{0,4})(?P<name>[^\n;]{2,100})'
+    r'|(?:\b(?i:Адрес\w{0,10}|Address)\s{0,4}:[ \t]{0,4})(?P<address>[^\n;]{5,200})'
+    r'|(?P<fio>\b[А-ЯЁ][а-яё]{1,30} [А-ЯЁ][а-яё]{1,30} [А-ЯЁ][а-яё]{1,30}(?:вич|вна|чна|оглы|кызы)\b)'
+    r')'
+)
+ENTITY_KINDS = {'link': 'links', 'email': 'emails', 'date': 'dates', 'phone': 'phones', 'name': 'names', 'address': 'addresses', 'fio': 'names'}
+ENTITY_MAX_PER_KIND = int(os.environ.get('ENTITY_MAX_PER_KIND', '200'))
+
+TELEGRAM_API_BASE = os.environ.get('TELEGRAM_API_BASE', 'https://api.telegram.org')
+HTTP_CONNECT_TIMEOUT = float(os.environ.get('HTTP_CONNECT_TIMEOUT', '5'))
+HTTP_READ_TIMEOUT = float(os.environ.get('HTTP_READ_TIMEOUT', '10'))
+HTTP_POOL_SIZE = int(os.environ.get('HTTP_POOL_SIZE', '4'))
+HTTP_MAX_RETRIES = int(os.environ.get('HTTP_MAX_RETRIES', '3'))
+HTTP_BACKOFF_BASE = 0.25
+HTTP_BACKOFF_MAX = 4.0
+HTTP_MAX_RETRY_AFTER = int(os.environ.get('HTTP_MAX_RETRY_AFTER', '5'))
+
+BOT_RATE_PER_SEC = float(os.environ.get('BOT_RATE_PER_SEC', '1'))
+BOT_BURST = float(os.environ.get('BOT_BURST', '3'))
+BATCH_MAX_QUERIES = int(os.environ.get('BATCH_MAX_QUERIES', '100'))
+# Как часто свободный бот проверяет, не вернулся ли в очередь запрос от бота с открытым breaker
+BATCH_POLL_INTERVAL = float(os.environ.get('BATCH_POLL_INTERVAL', '0.05'))
+
+# Token bucket на бота, общий для всех запросов тёплого экземпляра
+_bot_buckets: Dict[str, Dict[str, float]] = {}
+_bot_buckets_lock = threading.Lock()
+
+# Пул keep-alive соединений по хосту, переиспользуется тёплыми вызовами
+_http_pool: Dict[Tuple[str, str, int], List['http.client.HTTPConnection']] = {}
+_http_pool_lock = threading.Lock()
+HTTP_STATS: Dict[str, int] = {
+    'requests': 0,
+    'connections_opened': 0,
+    'pool_hits': 0,
+    'retries': 0,
+    'rate_limited': 0,
+    'errors': 0,
+    'hedged': 0
+}
+
+HEALTH_WINDOW = int(os.environ.get('HEALTH_WINDOW', '100'))
+BREAKER_FAILURES = int(os.environ.get('BREAKER_FAILURES', '5'))
+BREAKER_COOLDOWN = float(os.environ.get('BREAKER_COOLDOWN', '30'))
+HEDGE_REQUESTS = os.environ.get('HEDGE_REQUESTS', '1') != '0'
+HEDGE_MIN_SAMPLES = int(os.environ.get('HEDGE_MIN_SAMPLES', '20'))
+HEDGE_MIN_DELAY_MS = float(os.environ.get('HEDGE_MIN_DELAY_MS', '50'))
+
+# Скользящее окно вызовов Bot API и состояние circuit breaker по каждому боту
+_bot_health: Dict[str, Dict[str, Any]] = {}
+_bot_health_lock = threading.Lock()
+
+def _count(stat: str) -> None:
+    with _http_pool_lock:
+        HTTP_STATS[stat] += 1
+
+def get_http_stats() -> Dict[str, int]:
+    '''Snapshot of HTTP client counters'''
+    with _http_pool_lock:
+        return dict(HTTP_STATS)
+
+def _acquire_connection(scheme: str, host: str, port: int) -> Tuple['http.client.HTTPConnection', bool]:
+    '''Take idle connection from pool or open a new one
+    Returns: (connection, True if reused from pool)
+    '''
+    import http.client
+    
+    with _http_pool_lock:
+        idle = _http_pool.get((scheme, host, port))
+        if idle:
+            HTTP_STATS['pool_hits'] += 1
+            return idle.pop(), True
+        HTTP_STATS['connections_opened'] += 1
+    
+    conn_class = http.client.HTTPSConnection if scheme == 'https' else http.client.HTTPConnection
+    return conn_class(host, port, timeout=HTTP_CONNECT_TIMEOUT), False
+
+def _release_connection(scheme: str, host: str, port: int, conn: 'http.client.HTTPConnection') -> None:
+    '''Return connection to pool or close it when pool is full'''
+    with _http_pool_lock:
+        idle = _http_pool.setdefault((scheme, host, port), [])
+        if len(idle) < HTTP_POOL_SIZE:
+            idle.append(conn)
+            return
+    conn.close()
+
+def _drop_idle_connections(scheme: str, host: str, port: int) -> None:
+    '''Close all idle connections to the host; after one turned out stale the rest idled just as long'''
+    with _http_pool_lock:
+        idle = _http_pool.pop((scheme, host, port), [])
+    for conn in idle:
+        conn.close()
+
+def _backoff_delay(attempt: int, retry_after: Optional[float] = None) -> float:
+    '''Full-jitter exponential backoff, never shorter than Telegram retry_after'''
+    import random
+    
+    delay = random.uniform(0, min(HTTP_BACKOFF_MAX, HTTP_BACKOFF_BASE * (2 ** attempt)))
+    if retry_after is not None:
+        delay += retry_after
+    return delay
+
+def remaining_time(deadline: Optional[float]) -> float:
+    '''Seconds left until deadline (time.monotonic based), infinite when there is none'''
+    return float('inf') if deadline is None else deadline - time.monotonic()
+
+def sleep_within(delay: float, deadline: Optional[float]) -> bool:
+    '''Sleep before retry unless it would overrun the deadline
+    Returns: False if there is no time left for another attempt
+    '''
+    if delay >= remaining_time(deadline):
+        return False
+    time.sleep(delay)
+    return True
+
+def _health(bot_token: str) -> Dict[str, Any]:
+    '''Health record of a bot, created on first use (caller holds _bot_health_lock)'''
+    health = _bot_health.get(bot_token)
+    if health is None:
+        health = _bot_health[bot_token] = {
+            'outcomes': deque(maxlen=HEALTH_WINDOW),
+            'latencies': deque(maxlen=HEALTH_WINDOW),
+            'consecutive_failures': 0,
+            'state': 'closed',
+            'opened_at': 0.0,
+            'probe_started': None
+        }
+    return health
+
+def is_bot_failure(result: Dict[str, Any]) -> bool:
+    '''Network errors, 5xx and invalid token count against bot health; 4xx request errors and 429 do not'''
+    if result.get('ok'):
+        return False
+    error_code = result.get('error_code')
+    return error_code is None or error_code >= 500 or error_code in (401, 404)
+
+def record_bot_call(bot_token: str, ok: bool, latency_ms: Optional[float]) -> None:
+    '''Add call outcome to bot's window and move its circuit breaker'''
+    with _bot_health_lock:
+        health = _health(bot_token)
+        health['outcomes'].append(ok)
+        if latency_ms is not None:
+            health['latencies'].append(latency_ms)
+        health['probe_started'] = None
+        if ok:
+            health['consecutive_failures'] = 0
+            health['state'] = 'closed'
+            return
+        health['consecutive_failures'] += 1
+        if health['state'] == 'half_open' or health['consecutive_failures'] >= BREAKER_FAILURES:
+            health['state'] = 'open'
+            health['opened_at'] = time.monotonic()
+
+def circuit_open(bot_token: str) -> bool:
+    '''True while the bot's breaker is open and its cooldown has not passed'''
+    with _bot_health_lock:
+        health = _bot_health.get(bot_token)
+        return bool(health) and health['state'] == 'open' and time.monotonic() - health['opened_at'] < BREAKER_COOLDOWN
+
+def bot_allowed(bot_token: str) -> bool:
+    '''Whether a search may call the bot; after cooldown one caller is let through as half-open probe'''
+    with _bot_health_lock:
+        health = _bot_health.get(bot_token)
+        if not health or health['state'] == 'closed':
+            return True
+        now = time.monotonic()
+        # Проба, не дошедшая до вызова API (кэш, дедлайн), не должна держать бота выключенным
+        probe_started = health['probe_started']
+        if probe_started is not None and now - probe_started < BREAKER_COOLDOWN:
+            return False
+        if health['state'] == 'open' and now - health['opened_at'] < BREAKER_COOLDOWN:
+            return False
+        health['state'] = 'half_open'
+        health['probe_started'] = now
+        return True
+
+def latency_percentile(latencies: List[float], q: float) -> Optional[float]:
+    '''Nearest-rank percentile of latency samples in ms, rounded to 0.1; None without samples'''
+    if not latencies:
+        return None
+    ordered = sorted(latencies)
+    return round(ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))], 1)
+
+def hedge_delay(bot_token: str) -> Optional[float]:
+    '''Seconds to wait before hedging a call to the bot: its p95 latency, once enough samples exist'''
+    with _bot_health_lock:
+        latencies = list(_health(bot_token)['latencies'])
+    if len(latencies) < HEDGE_MIN_SAMPLES:
+        return None
+    return max(HEDGE_MIN_DELAY_MS, latency_percentile(latencies, 95)) / 1000
+
+def bot_health_snapshot() -> Dict[str, Dict[str, Any]]:
+    '''Per-bot success rate, latency percentiles and breaker state for the status endpoint'''
+    snapshot = {}
+    now = time.monotonic()
+    with _bot_health_lock:
+        for bot_token in BOT_TOKENS:
+            health = _health(bot_token)
+            outcomes = list(health['outcomes'])
+            latencies = list(health['latencies'])
+            snapshot[BOT_USERNAMES.get(bot_token, bot_store_id(bot_token))] = {
+                'state': health['state'],
+                'calls': len(outcomes),
+                'success_rate': round(sum(outcomes) / len(outcomes), 3) if outcomes else None,
+                'consecutive_failures': health['consecutive_failures'],
+                'p50_ms': latency_percentile(latencies, 50),
+                'p95_ms': latency_percentile(latencies, 95),
+                'p99_ms': latency_percentile(latencies, 99),
+                'retry_in_s': round(max(0.0, BREAKER_COOLDOWN - (now - health['opened_at'])), 1) if health['state'] == 'open' else 0
+            }
+    return snapshot
+
+def hedged_request(
+    bot_token: str,
+    api_method: str,
+    params: Optional[Dict[str, Any]],
+    payload: Optional[Dict[str, Any]],
+    read_timeout: float,
+    deadline: Optional[float]
+) -> Dict[str, Any]:
+    '''Idempotent call that starts a second identical request if the first runs past the bot's p95'''
+    from concurrent.futures import ThreadPoolExecutor, as_completed, wait, TimeoutError as FuturesTimeoutError
+    
+    delay = hedge_delay(bot_token)
+    if delay is None:
+        return _telegram_request(bot_token, api_method, params, payload, read_timeout, deadline)
+    
+    pool = ThreadPoolExecutor(max_workers=2)
+    try:
+        first = submit_in_context(pool, _telegram_request, bot_token, api_method, params, payload, read_timeout, deadline)
+        done, _ = wait([first], timeout=min(delay, max(0.0, remaining_time(deadline))))
+        if done:
+            return first.result()
+        
+        _count('hedged')
+        count_call('hedged')
+        second = submit_in_context(pool, _telegram_request, bot_token, api_method, params, payload, read_timeout, deadline)
+        timeout = None if deadline is None else max(0.0, remaining_time(deadline))
+        result: Dict[str, Any] = {'ok': False, 'description': 'Deadline exceeded'}
+        try:
+            for future in as_completed([first, second], timeout=timeout):
+                result = future.result()
+                if result.get('ok'):
+                    return result
+        except FuturesTimeoutError:
+            pass
+        return result
+    finally:
+        # Проигравший запрос дорабатывает в фоне, его время уже ограничено дедлайном
+        pool.shutdown(wait=False, cancel_futures=True)
+
+def deadline_exceeded(result: Dict[str, Any], deadline: Optional[float]) -> bool:
+    '''Failed call that ran out of the request's own budget (including a socket timeout clipped to it)'''
+    if result.get('ok'):
+        return False
+    return result.get('description') == 'Deadline exceeded' or (deadline is not None and remaining_time(deadline) <= 0)
+
+def telegram_api_call(
+    bot_token: str,
+    api_method: str,
+    params: Optional[Dict[str, Any]] = None,
+    payload: Optional[Dict[str, Any]] = None,
+    read_timeout: float = HTTP_READ_TIMEOUT,
+    deadline: Optional[float] = None,
+    hedge: bool = False
+) -> Dict[str, Any]:
+    '''Call Telegram Bot API and account the outcome in bot health
+    Args: hedge - call is idempotent and may be duplicated once it runs past the bot's p95 latency
+    '''
+    started = time.monotonic()
+    if hedge and HEDGE_REQUESTS:
+        result = hedged_request(bot_token, api_method, params, payload, read_timeout, deadline)
+    else:
+        result = _telegram_request(bot_token, api_method, params, payload, read_timeout, deadline)
+    
+    # Исчерпанный бюджет запроса — не вина бота; длительность long-poll не отражает его скорость
+    if not deadline_exceeded(result, deadline):
+        long_poll = bool((params or {}).get('timeout'))
+        latency_ms = None if long_poll else (time.monotonic() - started) * 1000
+        record_bot_call(bot_token, not is_bot_failure(result), latency_ms)
+    return result
+
+def _telegram_request(
+    bot_token: str,
+    api_method: str,
+    params: Optional[Dict[str, Any]] = None,
+    payload: Optional[Dict[str, Any]] = None,
+    read_timeout: float = HTTP_READ_TIMEOUT,
+    deadline: Optional[float] = None
+) -> Dict[str, Any]:
+    '''Call Telegram Bot API over pooled keep-alive connection with retries
+    Args: params - query string, payload - JSON body (switches to POST),
+          read_timeout - socket read timeout, long polls pass their own,
+          deadline - time.monotonic() bound for all attempts, timeouts and backoff
+    Returns: Telegram response dict; failures use Telegram error shape {ok: False, description}
+    '''
+    # http.client тянет за собой email.* и ssl — десятки миллисекунд импорта
+    import http.client
+    import socket
+    
+    base = urllib.parse.urlsplit(TELEGRAM_API_BASE)
+    scheme = base.scheme or 'https'
+    host = base.hostname or 'api.telegram.org'
+    port = base.port or (443 if scheme == 'https' else 80)
+    path = f'{base.path.rstrip("/")}/bot{bot_token}/{api_method}'
+    if params:
+        path += '?' + urllib.parse.urlencode(params)
+    
+    body = json.dumps(payload).encode('utf-8') if payload is not None else None
+    headers = {'Connection': 'keep-alive'}
+    if body is not None:
+        headers['Content-Type'] = 'application/json'
+    
+    result: Dict[str, Any] = {'ok': False, 'description': 'No attempts made'}
+    
+    for attempt in range(HTTP_MAX_RETRIES + 1):
+        remaining = remaining_time(deadline)
+        if remaining <= 0:
+            return {'ok': False, 'description': 'Deadline exceeded'}
+        if attempt:
+            _count('retries')
+        _count('requests')
+        count_call(api_method)
+        
+        conn, reused = _acquire_connection(scheme, host, port)
+        try:
+            if conn.sock is None:
+                conn.timeout = min(HTTP_CONNECT_TIMEOUT, remaining)
+                conn.connect()
+            conn.sock.settimeout(min(read_timeout, remaining))
+            conn.request('POST' if body is not None else 'GET', path, body=body, headers=headers)
+            response = conn.getresponse()
+            raw = response.read()
+        except (http.client.HTTPException, OSError) as e:
+            conn.close()
+            result = {'ok': False, 'description': str(e) or e.__class__.__name__}
+            # Протухшее keep-alive соединение переоткрываем сразу, без паузы; остальные простаивали
+            # столько же, поэтому пул хоста сбрасывается и следующая попытка идёт по новому соединению
+            if reused and not isinstance(e, socket.timeout):
+                _drop_idle_connections(scheme, host, port)
+                continue
+            _count('errors')
+            if attempt < HTTP_MAX_RETRIES and not sleep_within(_backoff_delay(attempt), deadline):
+                return result
+            continue
+        
+        if response.will_close:
+            conn.close()
+        else:
+            _release_connection(scheme, host, port, conn)
+        
+        try:
+            result = json.loads(raw.decode('utf-8'))
+        except ValueError:
+            result = {'ok': False, 'error_code': response.status, 'description': f'HTTP {response.status}'}
+        
+        if response.status == 429:
+            _count('rate_limited')
+            retry_after = (result.get('parameters') or {}).get('retry_after', 1)
+            # Ждать дольше, чем позволяет бюджет запроса, бессмысленно
+            if retry_after > HTTP_MAX_RETRY_AFTER or attempt >= HTTP_MAX_RETRIES:
+                return result
+            if not sleep_within(_backoff_delay(attempt, retry_after), deadline):
+                return result
+            continue
+        
+        if response.status >= 500:
+            _count('errors')
+            if attempt < HTTP_MAX_RETRIES and not sleep_within(_backoff_delay(attempt), deadline):
+                return result
+            continue
+        
+        return result
+    
+    return result
+
 def send_message_to_bot(bot_token: str, chat_id: str, text: str) -> Optional[Dict[str, Any]]:
     '''Send message to Telegram bot'''
-    url = f'https://api.telegram.org/bot{bot_token}/sendMessage'
     data = {
         'chat_id': chat_id,
         'text': text
     }
     
-    try:
-        req = urllib.request.Request(
-            url,
-            data=json.dumps(data).encode('utf-8'),
-            headers={'Content-Type': 'application/json'}
-        )
-        with urllib.request.urlopen(req, timeout=10) as response:
-            return json.loads(response.read().decode('utf-8'))
-    except Exception as e:
-        return {'error': str(e)}
+    with stage('send_message'):
+        result = telegram_api_call(bot_token, 'sendMessage', payload=data)
+    if not result.get('ok'):
+        return {'error': result.get('description', 'Unknown error')}
+    return result
 
-def get_bot_updates(bot_token: str, offset: int = -1, limit: int = 100) -> List[Dict[str, Any]]:
-    '''Get recent updates from Telegram bot'''
-    url = f'https://api.telegram.org/bot{bot_token}/getUpdates?offset={offset}&limit={limit}&timeout=30'
+def get_bot_updates(
+    bot_token: str,
+    offset: int = -1,
+    limit: int = 100,
+    timeout: int = UPDATES_LONG_POLL,
+    deadline: Optional[float] = None
+) -> List[Dict[str, Any]]:
+    '''Get recent updates from Telegram bot; long-poll is shortened to fit the deadline'''
+    if deadline is not None:
+        # Оставляем запас на сетевую задержку ответа после long-poll
+        timeout = max(0, min(timeout, int(remaining_time(deadline)) - 2))
+    params = {'offset': offset, 'limit': limit, 'timeout': timeout}
     
-    try:
-        with urllib.request.urlopen(url, timeout=35) as response:
-            data = json.loads(response.read().decode('utf-8'))
-            if data.get('ok'):
-                return data.get('result', [])
-    except Exception:
-        pass
+    with stage('get_updates'):
+        data = telegram_api_call(bot_token, 'getUpdates', params=params, read_timeout=timeout + 5, deadline=deadline)
+    if data.get('ok'):
+        return data.get('result', [])
     return []
 
-def get_bot_me(bot_token: str) -> Optional[Dict[str, Any]]:
-    '''Get bot information'''
-    url = f'https://api.telegram.org/bot{bot_token}/getMe'
-    
+def get_bot_me(bot_token: str, deadline: Optional[float] = None) -> Tuple[Optional[Dict[str, Any]], bool]:
+    '''Get bot information
+    Returns: (bot_info or None, True if the call failed only because the request deadline ran out)
+    '''
+    with stage('getme'):
+        data = telegram_api_call(bot_token, 'getMe', deadline=deadline, hedge=True)
+    if data.get('ok'):
+        return data.get('result'), False
+    return None, deadline_exceeded(data, deadline)
+
+def _store_bot_me(bot_token: str, bot_info: Optional[Dict[str, Any]]) -> None:
+    '''Save getMe result (or failure) into identity cache'''
+    with _bot_me_lock:
+        _bot_me_cache[bot_token] = {'info': bot_info, 'fetched_at': time.time()}
+
+def _refresh_bot_me(bot_token: str) -> None:
+    '''Background refresh of stale identity; keeps old value if bot is unreachable'''
     try:
-        with urllib.request.urlopen(url, timeout=10) as response:
-            data = json.loads(response.read().decode('utf-8'))
-            if data.get('ok'):
-                return data.get('result')
-    except Exception:
-        pass
-    return None
+        bot_info, _ = get_bot_me(bot_token)
+        if bot_info:
+            _store_bot_me(bot_token, bot_info)
+    finally:
+        with _bot_me_lock:
+            _bot_me_refreshing.discard(bot_token)
 
-def search_with_bot(bot_token: str, search_query: str, bot_username: str) -> Dict[str, Any]:
-    '''Search using Telegram bot by sending message and waiting for response'''
-    bot_name = BOT_USERNAMES.get(bot_token, 'Unknown Bot')
+def get_bot_me_cached(bot_token: str, deadline: Optional[float] = None) -> Tuple[Optional[Dict[str, Any]], bool, bool]:
+    '''Get bot information from cache with TTL, negative caching and stale-while-revalidate
+    Returns: (bot_info or None, True if served from cache, True if getMe failed only because the deadline ran out)
+    '''
+    now = time.time()
+    with _bot_me_lock:
+        entry = _bot_me_cache.get(bot_token)
     
-    bot_info = get_bot_me(bot_token)
+    if entry:
+        age = now - entry['fetched_at']
+        bot_info = entry['info']
+        ttl = BOT_ME_TTL if bot_info else BOT_ME_NEGATIVE_TTL
+        
+        if age < ttl:
+            return bot_info, True, False
+        
+        if bot_info and age < ttl + BOT_ME_STALE_TTL:
+            with _bot_me_lock:
+                start_refresh = bot_token not in _bot_me_refreshing
+                _bot_me_refreshing.add(bot_token)
+            if start_refresh:
+                threading.Thread(target=_refresh_bot_me, args=(bot_token,), daemon=True).start()
+            return bot_info, True, False
     
-    if not bot_info:
-        return {
-            'source': bot_name,
-            'description': 'Бот недоступен',
-            'query': search_query,
-            'found': False,
-            'error': 'Не удалось подключиться к боту',
-            'response_text': '',
-            'data': {}
-        }
+    bot_info, timed_out = get_bot_me(bot_token, deadline)
+    # Нехватка бюджета одного запроса не делает бота недоступным для остальных
+    if not timed_out:
+        _store_bot_me(bot_token, bot_info)
+    return bot_info, False, timed_out
+
+# Схема создаётся один раз на экземпляр; пропавший файл (очистка /tmp) создаётся заново
+_store_ready = False
+
+def open_update_store() -> 'sqlite3.Connection':
+    '''Open local SQLite store with acknowledged offsets and received messages'''
+    import sqlite3
     
-    updates_before = get_bot_updates(bot_token, offset=-1, limit=10)
-    last_update_id = updates_before[-1]['update_id'] if updates_before else 0
+    global _store_ready
+    ready = _store_ready and os.path.exists(UPDATE_STORE_PATH)
+    conn = sqlite3.connect(UPDATE_STORE_PATH, timeout=10)
+    if ready:
+        return conn
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute(
+        'CREATE TABLE IF NOT EXISTS bot_offsets ('
+        'bot_id TEXT PRIMARY KEY, next_offset INTEGER NOT NULL, updated_at INTEGER NOT NULL)'
+    )
+    conn.execute(
+        'CREATE TABLE IF NOT EXISTS bot_messages ('
+        'bot_id TEXT NOT NULL, update_id INTEGER NOT NULL, chat_id INTEGER, message_id INTEGER, '
+        'reply_to_id INTEGER, text TEXT, text_lower TEXT, date INTEGER, '
+        'PRIMARY KEY (bot_id, update_id))'
+    )
+    conn.execute('CREATE INDEX IF NOT EXISTS bot_messages_chat ON bot_messages (bot_id, chat_id, message_id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS bot_messages_text ON bot_messages (bot_id, text_lower, date)')
+    conn.execute('CREATE INDEX IF NOT EXISTS bot_messages_date ON bot_messages (bot_id, date)')
+    conn.execute(
+        'CREATE TABLE IF NOT EXISTS bot_responses ('
+        'id INTEGER PRIMARY KEY, bot_id TEXT NOT NULL, query_key TEXT NOT NULL, query TEXT, '
+        'response_text TEXT NOT NULL, created_at INTEGER NOT NULL)'
+    )
+    conn.execute('CREATE INDEX IF NOT EXISTS bot_responses_key ON bot_responses (query_key, bot_id, created_at)')
+    conn.execute('CREATE INDEX IF NOT EXISTS bot_responses_created ON bot_responses (created_at)')
+    conn.execute(
+        'CREATE VIRTUAL TABLE IF NOT EXISTS bot_responses_fts USING fts5('
+        "response_text, content='bot_responses', content_rowid='id', tokenize='unicode61')"
+    )
+    conn.execute(
+        'CREATE TRIGGER IF NOT EXISTS bot_responses_ai AFTER INSERT ON bot_responses BEGIN '
+        'INSERT INTO bot_responses_fts (rowid, response_text) VALUES (new.id, new.response_text); END'
+    )
+    conn.execute(
+        'CREATE TRIGGER IF NOT EXISTS bot_responses_ad AFTER DELETE ON bot_responses BEGIN '
+        "INSERT INTO bot_responses_fts (bot_responses_fts, rowid, response_text) VALUES ('delete', old.id, old.response_text); END"
+    )
+    conn.execute(
+        'CREATE TABLE IF NOT EXISTS search_flights ('
+        'bot_id TEXT NOT NULL, query_key TEXT NOT NULL, expires_at REAL NOT NULL, result TEXT, '
+        'PRIMARY KEY (bot_id, query_key))'
+    )
+    _store_ready = True
+    return conn
+
+def bot_store_id(bot_token: str) -> str:
+    '''Numeric bot id from token, so tokens are never written to disk'''
+    return bot_token.split(':', 1)[0]
+
+def store_updates(conn: 'sqlite3.Connection', bot_id: str, updates: List[Dict[str, Any]], acknowledge: bool = True) -> None:
+    '''Save text messages from updates and acknowledge offset in one transaction
+    Args: acknowledge - advance getUpdates offset; webhook deliveries have no offset to track
+    '''
+    rows = []
+    for update in updates:
+        msg = update.get('message')
+        if not msg or not msg.get('text'):
+            continue
+        reply_to = msg.get('reply_to_message') or {}
+        rows.append((
+            bot_id,
+            update['update_id'],
+            (msg.get('chat') or {}).get('id'),
+            msg.get('message_id'),
+            reply_to.get('message_id'),
+            msg['text'],
+            msg['text'].lower(),
+            msg.get('date', int(time.time()))
+        ))
     
-    bot_chat = BOT_CHAT_IDS.get(bot_token, bot_username)
+    with conn:
+        conn.executemany('INSERT OR IGNORE INTO bot_messages VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rows)
+        if not acknowledge:
+            return
+        conn.execute(
+            'INSERT INTO bot_offsets VALUES (?, ?, ?) '
+            'ON CONFLICT(bot_id) DO UPDATE SET next_offset = excluded.next_offset, updated_at = excluded.updated_at',
+            (bot_id, updates[-1]['update_id'] + 1, int(time.time()))
+        )
+
+def consume_updates(bot_token: str, conn: 'sqlite3.Connection', deadline: Optional[float] = None) -> int:
+    '''Drain pending updates page by page starting from the acknowledged offset
+    Returns: number of updates consumed
+    '''
+    bot_id = bot_store_id(bot_token)
+    row = conn.execute('SELECT next_offset FROM bot_offsets WHERE bot_id = ?', (bot_id,)).fetchone()
+    offset = row[0] if row else 0
+    consumed = 0
     
-    collected_responses = []
+    for page in range(UPDATES_MAX_PAGES):
+        if remaining_time(deadline) <= 0:
+            break
+        # Ждём новые сообщения только на первой странице, остальной бэклог забираем без ожидания
+        updates = get_bot_updates(
+            bot_token,
+            offset=offset,
+            limit=UPDATES_PAGE_SIZE,
+            timeout=UPDATES_LONG_POLL if page == 0 else 0,
+            deadline=deadline
+        )
+        if not updates:
+            break
+        with stage('store'):
+            store_updates(conn, bot_id, updates)
+        offset = updates[-1]['update_id'] + 1
+        consumed += len(updates)
+        if len(updates) < UPDATES_PAGE_SIZE:
+            break
     
-    updates_after = get_bot_updates(bot_token, offset=last_update_id + 1, limit=50)
+    prune_updates(conn, bot_id)
+    return consumed
+
+def prune_updates(conn: 'sqlite3.Connection', bot_id: str) -> None:
+    '''Drop messages older than the correlation window'''
+    with conn:
+        conn.execute(
+            'DELETE FROM bot_messages WHERE bot_id = ? AND date < ?',
+            (bot_id, int(time.time()) - RESPONSE_WINDOW)
+        )
+
+def ingest_webhook_update(bot_id: str, update: Dict[str, Any]) -> None:
+    '''Write one update delivered by Telegram webhook into the local store'''
+    with stage('store'):
+        conn = open_update_store()
+        try:
+            store_updates(conn, bot_id, [update], acknowledge=False)
+            prune_updates(conn, bot_id)
+        finally:
+            conn.close()
+
+def wait_for_responses(conn: 'sqlite3.Connection', bot_token: str, search_query: str, deadline: Optional[float] = None) -> List[str]:
+    '''Re-read the store until a correlated reply arrives via webhook or the wait runs out'''
+    wait_until = min(time.monotonic() + WEBHOOK_RESPONSE_WAIT, deadline if deadline is not None else float('inf'))
+    while True:
+        responses = find_bot_responses(conn, bot_token, search_query)
+        if responses or not sleep_within(WEBHOOK_POLL_INTERVAL, wait_until):
+            return responses
+
+def find_bot_responses(conn: 'sqlite3.Connection', bot_token: str, search_query: str) -> List[str]:
+    '''Collect replies correlated with query messages by chat id and reply_to_message'''
+    bot_id = bot_store_id(bot_token)
+    query_lower = search_query.lower()
+    since = int(time.time()) - RESPONSE_WINDOW
     
-    if updates_after:
-        for update in updates_after:
-            if 'message' in update:
-                msg = update['message']
-                msg_text = msg.get('text', '')
-                
-                if msg_text and msg_text.lower() != search_query.lower():
-                    collected_responses.append(msg_text)
+    query_messages = conn.execute(
+        'SELECT chat_id, message_id FROM bot_messages WHERE bot_id = ? AND text_lower = ? AND date >= ?',
+        (bot_id, query_lower, since)
+    ).fetchall()
     
-    full_response_text = '\n\n'.join(collected_responses) if collected_responses else 'Бот не вернул ответ. Возможно нужно сначала написать боту /start или отправить запрос вручную.'
+    responses: List[str] = []
+    seen: set = set()
+    for chat_id, message_id in query_messages:
+        # Ответ — reply на сообщение с запросом либо сообщение без reply в том же чате после запроса,
+        # но до следующего запроса; сами запросы ответами не считаются
+        rows = conn.execute(
+            'SELECT update_id, reply_to_id, text FROM bot_messages WHERE bot_id = ? AND chat_id = ? AND date >= ? '
+            'AND (reply_to_id = ? OR message_id > ?) ORDER BY message_id',
+            (bot_id, chat_id, since, message_id, message_id)
+        ).fetchall()
+        unreplied_open = True
+        for update_id, reply_to_id, text in rows:
+            if QUERY_MESSAGE_PATTERN.fullmatch(text):
+                unreplied_open = False
+                continue
+            if reply_to_id != message_id and (reply_to_id is not None or not unreplied_open):
+                continue
+            if update_id not in seen:
+                seen.add(update_id)
+                responses.append(text)
+    
+    return responses
+
+def query_key(search_query: str) -> str:
+    '''Normalized index key: case, leading @/+ and phone separators do not matter'''
+    return QUERY_KEY_SEPARATORS.sub('', search_query).lower().lstrip('@+')
+
+def index_response(conn: 'sqlite3.Connection', bot_token: str, search_query: str, response_text: str) -> None:
+    '''Remember bot response for the query; an unchanged repeat only refreshes its timestamp'''
+    bot_id = bot_store_id(bot_token)
+    key = query_key(search_query)
+    now = int(time.time())
+    with conn:
+        row = conn.execute(
+            'SELECT id, response_text FROM bot_responses WHERE query_key = ? AND bot_id = ? '
+            'ORDER BY created_at DESC LIMIT 1',
+            (key, bot_id)
+        ).fetchone()
+        if row and row[1] == response_text:
+            conn.execute('UPDATE bot_responses SET created_at = ? WHERE id = ?', (now, row[0]))
+        else:
+            conn.execute(
+                'INSERT INTO bot_responses (bot_id, query_key, query, response_text, created_at) VALUES (?, ?, ?, ?, ?)',
+                (bot_id, key, search_query, response_text, now)
+            )
+        conn.execute('DELETE FROM bot_responses WHERE created_at < ?', (now - RESPONSE_HISTORY_TTL,))
+
+def find_indexed_response(conn: 'sqlite3.Connection', bot_token: str, search_query: str, max_age: int) -> Optional[Tuple[str, int]]:
+    '''Latest indexed (response_text, created_at) for the query if not older than max_age seconds'''
+    return conn.execute(
+        'SELECT response_text, created_at FROM bot_responses WHERE query_key = ? AND bot_id = ? AND created_at >= ? '
+        'ORDER BY created_at DESC LIMIT 1',
+        (query_key(search_query), bot_store_id(bot_token), int(time.time()) - max_age)
+    ).fetchone()
+
+def search_history(text: str, limit: int = HISTORY_SEARCH_LIMIT) -> List[Dict[str, Any]]:
+    '''Full-text search across all indexed bot responses, best matches first'''
+    # Каждое слово в кавычках, чтобы пользовательский ввод не разбирался как синтаксис FTS5
+    match = ' '.join('"' + term.replace('"', '""') + '"' for term in text.split())
+    bot_names = {bot_store_id(bot_token): bot_username for bot_token, bot_username in BOT_USERNAMES.items()}
+    conn = open_update_store()
+    try:
+        rows = conn.execute(
+            "SELECT r.bot_id, r.query, r.created_at, snippet(bot_responses_fts, 0, '[', ']', '…', 16), r.response_text "
+            'FROM bot_responses_fts JOIN bot_responses r ON r.id = bot_responses_fts.rowid '
+            'WHERE bot_responses_fts MATCH ? ORDER BY rank LIMIT ?',
+            (match, limit)
+        ).fetchall()
+    finally:
+        conn.close()
+    
+    return [
+        {
+            'source': bot_names.get(bot_id, 'Unknown Bot'),
+            'query': search_query,
+            'indexed_at': created_at,
+            'snippet': snippet,
+            'response_text': response_text
+        }
+        for bot_id, search_query, created_at, snippet, response_text in rows
+    ]
+
+def entity_key(kind: str, value: str) -> str:
+    '''Dedup key: phones by digits with Russian trunk prefix 8 as 7, the rest case- and space-insensitive'''
+    if kind == 'phones':
+        digits = ''.join(ch for ch in value if ch.isdigit())
+        return '7' + digits[1:] if len(digits) == 11 and digits[0] == '8' else digits
+    return ' '.join(value.split()).casefold()
+
+def extract_entities(text: str) -> Dict[str, List[str]]:
+    '''Phones, emails, names, addresses, dates and links found in text in one pass, deduplicated in order of appearance'''
+    entities: Dict[str, List[str]] = {}
+    seen: set = set()
+    for match in ENTITY_PATTERN.finditer(text):
+        kind = ENTITY_KINDS[match.lastgroup]
+        value = match.group(match.lastgroup).strip().rstrip('.,;:)')
+        if kind == 'names':
+            value = ' '.join(value.split())
+        key = (kind, entity_key(kind, value))
+        if key in seen:
+            continue
+        seen.add(key)
+        values = entities.setdefault(kind, [])
+        if len(values) < ENTITY_MAX_PER_KIND:
+            values.append(value)
+    return entities
+
+def merge_entities(results: List[Dict[str, Any]]) -> Dict[str, List[Dict[str, Any]]]:
+    '''Entities of all bot results deduplicated across bots, each with the list of bots that returned it'''
+    merged: Dict[str, List[Dict[str, Any]]] = {}
+    index: Dict[Tuple[str, str], Dict[str, Any]] = {}
+    for result in results:
+        for kind, values in (result.get('entities') or {}).items():
+            for value in values:
+                key = (kind, entity_key(kind, value))
+                entry = index.get(key)
+                if entry is None:
+                    entry = index[key] = {'value': value, 'sources': []}
+                    merged.setdefault(kind, []).append(entry)
+                if result['source'] not in entry['sources']:
+                    entry['sources'].append(result['source'])
+    return merged
+
+def search_with_bot(
+    bot_token: str,
+    search_query: str,
+    bot_username: str,
+    deadline: Optional[float] = None,
+    max_age: int = 0
+) -> Dict[str, Any]:
+    '''Search using Telegram bot by sending message and waiting for response
+    Args: max_age - serve an indexed response not older than this many seconds without asking the bot
+    '''
+    bot_name = BOT_USERNAMES.get(bot_token, 'Unknown Bot')
+    
+    with stage('store_open'):
+        conn = open_update_store()
+    try:
+        if max_age:
+            with stage('history'):
+                indexed = find_indexed_response(conn, bot_token, search_query, max_age)
+            if indexed:
+                response_text, indexed_at = indexed
+                with stage('extract'):
+                    entities = extract_entities(response_text)
+                return {
+                    'source': bot_name,
+                    'description': f'Бот: @{bot_name}',
+                    'query': search_query,
+                    'found': True,
+                    'response_text': response_text,
+                    'entities': entities,
+                    'data': {
+                        'search_term': search_query,
+                        'status': 'indexed',
+                        'from_index': True,
+                        'indexed_at': indexed_at
+                    }
+                }
+        
+        if not bot_allowed(bot_token):
+            return {
+                'source': bot_name,
+                'description': 'Бот временно отключён',
+                'query': search_query,
+                'found': False,
+                'error': 'Бот недавно не отвечал, повторная проверка после паузы',
+                'response_text': '',
+                'data': {'circuit': 'open'}
+            }
+        
+        bot_info, identity_cached, identity_timed_out = get_bot_me_cached(bot_token, deadline)
+        
+        if identity_timed_out:
+            return bot_timeout_result(bot_token, search_query)
+        if not bot_info:
+            return {
+                'source': bot_name,
+                'description': 'Бот недоступен',
+                'query': search_query,
+                'found': False,
+                'error': 'Не удалось подключиться к боту',
+                'response_text': '',
+                'data': {'identity_cached': identity_cached}
+            }
+        
+        bot_chat = BOT_CHAT_IDS.get(bot_token, bot_username)
+        
+        if UPDATE_MODE == 'webhook':
+            updates_consumed = 0
+            with stage('correlate'):
+                collected_responses = wait_for_responses(conn, bot_token, search_query, deadline)
+        else:
+            updates_consumed = consume_updates(bot_token, conn, deadline)
+            with stage('correlate'):
+                collected_responses = find_bot_responses(conn, bot_token, search_query)
+        
+        full_response_text = '\n\n'.join(collected_responses) if collected_responses else 'Бот не вернул ответ. Возможно нужно сначала написать боту /start или отправить запрос вручную.'
+        entities: Dict[str, List[str]] = {}
+        if collected_responses:
+            with stage('index'):
+                index_response(conn, bot_token, search_query, full_response_text)
+            with stage('extract'):
+                entities = extract_entities(full_response_text)
+    finally:
+        conn.close()
     
     bot_data = {
         'bot_id': bot_info.get('id'),
@@ -109,7 +1241,10 @@ def search_with_bot(bot_token: str, search_query: str, bot_username: str) -> Dic
         'bot_name': bot_info.get('first_name'),
         'search_term': search_query,
         'messages_received': len(collected_responses),
-        'status': 'online'
+        'updates_consumed': updates_consumed,
+        'status': 'online',
+        'identity_cached': identity_cached,
+        'from_index': False
     }
     
     return {
@@ -118,14 +1253,470 @@ def search_with_bot(bot_token: str, search_query: str, bot_username: str) -> Dic
         'query': search_query,
         'found': len(collected_responses) > 0,
         'response_text': full_response_text,
+        'entities': entities,
         'data': bot_data
     }
 
+def follower_result(result: Dict[str, Any], search_query: str) -> Dict[str, Any]:
+    '''Copy of leader's result for a coalesced caller'''
+    return dict(result, query=search_query, coalesced=True)
+
+def leader_ran_out(result: Dict[str, Any], deadline: Optional[float]) -> bool:
+    '''Leader's failure came from its own request budget, so it must not be shared with callers that have more'''
+    return not result.get('found') and (bool(result.get('timed_out')) or remaining_time(deadline) <= 0)
+
+def acquire_flight_lease(conn: 'sqlite3.Connection', bot_id: str, key: str) -> bool:
+    '''Become cross-process leader for the query unless a live lease or fresh result exists'''
+    now = time.time()
+    with conn:
+        conn.execute('DELETE FROM search_flights WHERE expires_at < ?', (now,))
+        cursor = conn.execute(
+            'INSERT OR IGNORE INTO search_flights (bot_id, query_key, expires_at, result) VALUES (?, ?, ?, NULL)',
+            (bot_id, key, now + FUNCTION_TIMEOUT)
+        )
+    return cursor.rowcount == 1
+
+def shared_flight_search(
+    bot_token: str,
+    search_query: str,
+    bot_username: str,
+    deadline: Optional[float] = None,
+    max_age: int = 0
+) -> Dict[str, Any]:
+    '''Run search_with_bot under a lease in the shared store; other processes wait for the published result'''
+    bot_id = bot_store_id(bot_token)
+    key = f'{max_age}:{query_key(search_query)}'
+    
+    conn = open_update_store()
+    try:
+        while not acquire_flight_lease(conn, bot_id, key):
+            row = conn.execute(
+                'SELECT result FROM search_flights WHERE bot_id = ? AND query_key = ?', (bot_id, key)
+            ).fetchone()
+            if row and row[0]:
+                return follower_result(json.loads(row[0]), search_query)
+            if not sleep_within(COALESCE_POLL_INTERVAL, deadline):
+                return bot_timeout_result(bot_token, search_query)
+        
+        try:
+            result = search_with_bot(bot_token, search_query, bot_username, deadline, max_age)
+        except Exception:
+            with conn:
+                conn.execute('DELETE FROM search_flights WHERE bot_id = ? AND query_key = ?', (bot_id, key))
+            raise
+        
+        # Провал из-за собственного дедлайна не публикуем: следующий процесс возьмёт аренду и поищет сам
+        if leader_ran_out(result, deadline):
+            with conn:
+                conn.execute('DELETE FROM search_flights WHERE bot_id = ? AND query_key = ?', (bot_id, key))
+            return result
+        
+        # Результат доступен опоздавшим ещё COALESCE_RESULT_GRACE секунд, потом запись удаляется
+        with conn:
+            conn.execute(
+                'UPDATE search_flights SET result = ?, expires_at = ? WHERE bot_id = ? AND query_key = ?',
+                (dumps(result), time.time() + COALESCE_RESULT_GRACE, bot_id, key)
+            )
+        return result
+    finally:
+        conn.close()
+
+def coalesced_search(
+    bot_token: str,
+    search_query: str,
+    bot_username: str,
+    deadline: Optional[float] = None,
+    max_age: int = 0
+) -> Dict[str, Any]:
+    '''search_with_bot with single-flight: concurrent calls for the same bot, normalized query and max_age share one run
+    Returns: bot result with coalesced flag; followers that outlive their deadline get a timeout result,
+             followers of a leader that ran out of its own budget search again while they have time
+    '''
+    key = (bot_token, query_key(search_query), max_age)
+    with _flights_lock:
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _flights[key] = {'done': threading.Event(), 'result': None, 'error': None, 'ran_out': False}
+    
+    if not leader:
+        count_call('coalesced')
+        timeout = None if deadline is None else max(0.0, remaining_time(deadline))
+        with stage('coalesce_wait'):
+            finished = flight['done'].wait(timeout)
+        if not finished:
+            return bot_timeout_result(bot_token, search_query)
+        if flight['error'] is not None:
+            raise flight['error']
+        # У лидера кончился его бюджет, а у этого вызова время ещё есть — ищем заново
+        if flight['ran_out'] and remaining_time(deadline) > 0:
+            return coalesced_search(bot_token, search_query, bot_username, deadline, max_age)
+        return follower_result(flight['result'], search_query)
+    
+    try:
+        if COALESCE_SHARED:
+            result = shared_flight_search(bot_token, search_query, bot_username, deadline, max_age)
+        else:
+            result = search_with_bot(bot_token, search_query, bot_username, deadline, max_age)
+        result.setdefault('coalesced', False)
+        flight['result'] = result
+        flight['ran_out'] = leader_ran_out(result, deadline)
+        return result
+    except Exception as e:
+        flight['error'] = e
+        raise
+    finally:
+        with _flights_lock:
+            _flights.pop(key, None)
+        flight['done'].set()
+
+def bot_error_result(bot_token: str, search_query: str, error: str) -> Dict[str, Any]:
+    '''Build result object for a bot whose search failed unexpectedly'''
+    return {
+        'source': BOT_USERNAMES.get(bot_token, 'Unknown Bot'),
+        'description': 'Ошибка поиска',
+        'query': search_query,
+        'found': False,
+        'error': error,
+        'response_text': '',
+        'data': {}
+    }
+
+def bot_timeout_result(bot_token: Optional[str], search_query: str) -> Dict[str, Any]:
+    '''Build result object for a bot (or queued batch item) that did not finish within the request budget'''
+    return {
+        'source': BOT_USERNAMES.get(bot_token, 'Unknown Bot') if bot_token else '',
+        'description': 'Бот не успел ответить',
+        'query': search_query,
+        'found': False,
+        'error': 'Превышено время ожидания ответа бота',
+        'response_text': '',
+        'data': {},
+        'timed_out': True
+    }
+
+def iter_bot_results(
+    search_query: str,
+    bot_tokens: Optional[List[str]] = None,
+    max_workers: int = BOT_CONCURRENCY,
+    deadline: Optional[float] = None,
+    max_age: int = 0
+) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    '''Run search on bots concurrently, yield (bot_token, result) as soon as each bot finishes;
+    bots still running at the deadline are abandoned and yielded as timed out
+    '''
+    from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeoutError
+    
+    bot_tokens = bot_tokens or BOT_TOKENS
+    workers = max(1, min(max_workers, len(bot_tokens)))
+    
+    pool = ThreadPoolExecutor(max_workers=workers)
+    futures = {
+        submit_in_context(pool, coalesced_search, bot_token, search_query, BOT_USERNAMES.get(bot_token, 'unknown'), deadline, max_age): bot_token
+        for bot_token in bot_tokens
+    }
+    pending = set(futures.values())
+    try:
+        timeout = None if deadline is None else max(0.0, remaining_time(deadline))
+        for future in as_completed(futures, timeout=timeout):
+            bot_token = futures[future]
+            pending.discard(bot_token)
+            try:
+                result = future.result()
+            except Exception as e:
+                result = bot_error_result(bot_token, search_query, str(e))
+            yield bot_token, result
+    except FuturesTimeoutError:
+        for bot_token in bot_tokens:
+            if bot_token in pending:
+                yield bot_token, bot_timeout_result(bot_token, search_query)
+    finally:
+        # Не ждём зависшие потоки: их сетевые таймауты уже ограничены дедлайном
+        pool.shutdown(wait=False, cancel_futures=True)
+
+def search_all_bots(
+    search_query: str,
+    bot_tokens: Optional[List[str]] = None,
+    max_workers: int = BOT_CONCURRENCY,
+    deadline: Optional[float] = None,
+    max_age: int = 0
+) -> List[Dict[str, Any]]:
+    '''Run search on bots concurrently, results keep BOT_TOKENS order'''
+    bot_tokens = bot_tokens or BOT_TOKENS
+    results = dict(iter_bot_results(search_query, bot_tokens, max_workers, deadline, max_age))
+    return [results[bot_token] for bot_token in bot_tokens]
+
+def select_bots(selector: Any) -> Optional[List[str]]:
+    '''Resolve optional bot selector (index or username) to token list; None if selector is invalid'''
+    if selector is None:
+        return BOT_TOKENS
+    if isinstance(selector, int) and not isinstance(selector, bool) and 0 <= selector < len(BOT_TOKENS):
+        return [BOT_TOKENS[selector]]
+    if isinstance(selector, str):
+        for bot_token, bot_username in BOT_USERNAMES.items():
+            if bot_username.lower() == selector.lstrip('@').lower():
+                return [bot_token]
+    return None
+
+def sse_event(event: str, data: Dict[str, Any]) -> str:
+    '''Format one Server-Sent Events message'''
+    return f'event: {event}\ndata: {dumps(data)}\n\n'
+
+def iter_search_events(
+    search_query: str,
+    bot_tokens: List[str],
+    query: Dict[str, str],
+    deadline: Optional[float] = None,
+    max_age: int = 0,
+    fields: Optional[Dict[str, Any]] = None
+) -> Iterator[str]:
+    '''SSE stream: one result event per bot in completion order, then a summary event
+    Args: fields - projection tree; its results subtree trims each result event
+    '''
+    result_fields = (fields or {}).get('results')
+    started = time.monotonic()
+    found = 0
+    timed_out = 0
+    results = []
+    for bot_token, result in iter_bot_results(search_query, bot_tokens, deadline=deadline, max_age=max_age):
+        results.append(result)
+        found += 1 if result.get('found') else 0
+        timed_out += 1 if result.get('timed_out') else 0
+        yield sse_event('result', {
+            'index': BOT_TOKENS.index(bot_token),
+            'elapsed_ms': int((time.monotonic() - started) * 1000),
+            'result': project(result, result_fields)
+        })
+    yield sse_event('summary', {
+        'success': True,
+        'bots': len(bot_tokens),
+        'found': found,
+        'timed_out': timed_out,
+        'partial': timed_out > 0,
+        'entities': merge_entities(results),
+        'query': query,
+        'elapsed_ms': int((time.monotonic() - started) * 1000),
+        'timestamp': int(time.time())
+    })
+
+def no_bots_result(search_query: str) -> Dict[str, Any]:
+    '''Build result object for a batch item no bot can take'''
+    return {
+        'source': '',
+        'description': 'Нет доступных ботов',
+        'query': search_query,
+        'found': False,
+        'error': 'Все боты недоступны',
+        'response_text': '',
+        'data': {},
+        'queue_wait_ms': 0
+    }
+
+def take_bot_token(bot_token: str) -> float:
+    '''Take one token from bot's bucket
+    Returns: 0 if token taken, otherwise seconds until next token is available
+    '''
+    now = time.monotonic()
+    with _bot_buckets_lock:
+        bucket = _bot_buckets.setdefault(bot_token, {'tokens': BOT_BURST, 'updated': now})
+        bucket['tokens'] = min(BOT_BURST, bucket['tokens'] + (now - bucket['updated']) * BOT_RATE_PER_SEC)
+        bucket['updated'] = now
+        if bucket['tokens'] >= 1:
+            bucket['tokens'] -= 1
+            return 0.0
+        return (1 - bucket['tokens']) / BOT_RATE_PER_SEC
+
+def search_batch(queries: List[str], deadline: Optional[float] = None, max_age: int = 0) -> List[Dict[str, Any]]:
+    '''Spread queued queries across healthy bots, pacing each bot with its token bucket
+    Returns: one bot result per query in input order, with queue_wait_ms; unfinished ones timed out
+    '''
+    import queue
+    from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeoutError
+    
+    # getMe ботов проверяются параллельно, чтобы медленный бот не съел бюджет проверки остальных
+    candidates = [bot_token for bot_token in BOT_TOKENS if not circuit_open(bot_token)]
+    identities: List[Tuple[Optional[Dict[str, Any]], bool, bool]] = []
+    if candidates:
+        with ThreadPoolExecutor(max_workers=len(candidates)) as pool:
+            checks = [submit_in_context(pool, get_bot_me_cached, bot_token, deadline) for bot_token in candidates]
+            identities = [check.result() for check in checks]
+    healthy = [bot_token for bot_token, (bot_info, _, _) in zip(candidates, identities) if bot_info]
+    results: List[Optional[Dict[str, Any]]] = [None] * len(queries)
+    
+    if not healthy:
+        # Боты, не успевшие ответить на getMe в рамках бюджета, не недоступны: запросы просто не успели
+        if any(timed_out for _, _, timed_out in identities):
+            return [dict(bot_timeout_result(None, search_query), queue_wait_ms=0) for search_query in queries]
+        return [no_bots_result(search_query) for search_query in queries]
+    
+    pending: 'queue.Queue[Tuple[int, str]]' = queue.Queue()
+    for item in enumerate(queries):
+        pending.put(item)
+    enqueued_at = time.monotonic()
+    # Запросы, взятые воркерами: пока они не завершены, очередь может пополниться возвращёнными
+    in_flight = [0]
+    in_flight_lock = threading.Lock()
+    tripped: set = set()
+    
+    def bot_worker(bot_token: str) -> None:
+        # Каждый бот забирает следующий запрос из общей очереди, как только его bucket позволяет
+        while True:
+            # Бот, у которого breaker открылся посреди пакета, оставляет очередь остальным
+            if circuit_open(bot_token):
+                tripped.add(bot_token)
+                return
+            if pending.empty():
+                with in_flight_lock:
+                    if not in_flight[0]:
+                        return
+                if not sleep_within(BATCH_POLL_INTERVAL, deadline):
+                    return
+                continue
+            wait = take_bot_token(bot_token)
+            if wait:
+                if not sleep_within(wait, deadline):
+                    return
+                continue
+            with in_flight_lock:
+                try:
+                    index, search_query = pending.get_nowait()
+                except queue.Empty:
+                    continue
+                in_flight[0] += 1
+            queue_wait = time.monotonic() - enqueued_at
+            try:
+                result = coalesced_search(bot_token, search_query, BOT_USERNAMES.get(bot_token, 'unknown'), deadline, max_age)
+            except Exception as e:
+                result = bot_error_result(bot_token, search_query, str(e))
+            if result.get('data', {}).get('circuit') == 'open':
+                pending.put((index, search_query))
+            else:
+                result['queue_wait_ms'] = int(queue_wait * 1000)
+                results[index] = result
+            with in_flight_lock:
+                in_flight[0] -= 1
+    
+    pool = ThreadPoolExecutor(max_workers=len(healthy))
+    workers = [submit_in_context(pool, bot_worker, bot_token) for bot_token in healthy]
+    wait_timeout = None if deadline is None else max(0.0, remaining_time(deadline))
+    try:
+        for _ in as_completed(workers, timeout=wait_timeout):
+            pass
+    except FuturesTimeoutError:
+        pass
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+    
+    # Запросы, до которых не дошла очередь или не успевшие завершиться, помечаем timed_out;
+    # если же breaker открылся у всех ботов, оставшиеся запросы обрабатывать некому
+    if tripped.issuperset(healthy):
+        return [result if result is not None else no_bots_result(queries[index]) for index, result in enumerate(list(results))]
+    waited_ms = int((time.monotonic() - enqueued_at) * 1000)
+    return [
+        result if result is not None else dict(bot_timeout_result(None, queries[index]), queue_wait_ms=waited_ms)
+        for index, result in enumerate(list(results))
+    ]
+
+def batch_body(results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    '''Response body for batch mode'''
+    return {
+        'success': True,
+        'results': results,
+        'partial': any(result.get('timed_out') for result in results),
+        'timestamp': int(time.time())
+    }
+
+def request_deadline(context: Any, body_data: Dict[str, Any]) -> float:
+    '''Request-scoped time.monotonic() deadline from platform remaining time and optional client deadline_ms'''
+    budget = FUNCTION_TIMEOUT
+    get_remaining = getattr(context, 'get_remaining_time_in_millis', None)
+    if callable(get_remaining):
+        budget = get_remaining() / 1000
+    elif getattr(context, 'deadline_ms', None):
+        budget = context.deadline_ms / 1000 - time.time()
+    
+    client_deadline = body_data.get('deadline_ms')
+    if isinstance(client_deadline, (int, float)) and not isinstance(client_deadline, bool) and client_deadline > 0:
+        budget = min(budget, client_deadline / 1000)
+    
+    return time.monotonic() + max(0.0, budget - DEADLINE_RESERVE)
+
+def request_max_age(body_data: Dict[str, Any]) -> int:
+    '''Freshness window for cache-first lookups: cache_first flag (default CACHE_FIRST) and optional max_age seconds'''
+    if not body_data.get('cache_first', CACHE_FIRST):
+        return 0
+    max_age = body_data.get('max_age')
+    if isinstance(max_age, int) and not isinstance(max_age, bool) and max_age > 0:
+        return max_age
+    return RESPONSE_FRESHNESS
+
+def get_header(event: Dict[str, Any], name: str) -> str:
+    '''Case-insensitive request header lookup'''
+    name = name.lower()
+    for key, value in (event.get('headers') or {}).items():
+        if key.lower() == name:
+            return value or ''
+    return ''
+
+def webhook_secret_valid(event: Dict[str, Any]) -> bool:
+    '''Webhook is accepted only in webhook mode with a configured secret that the delivery carries'''
+    import hmac
+    
+    if UPDATE_MODE != 'webhook' or not WEBHOOK_SECRET:
+        return False
+    return hmac.compare_digest(get_header(event, 'X-Telegram-Bot-Api-Secret-Token'), WEBHOOK_SECRET)
+
+def webhook_response(event: Dict[str, Any], bot_id: str) -> Dict[str, Any]:
+    '''Accept Telegram webhook delivery for a known bot, checking the secret token header'''
+    # Без секрета вебхук позволил бы кому угодно подложить «ответ бота» в хранилище
+    if UPDATE_MODE != 'webhook' or not WEBHOOK_SECRET:
+        status, payload = 404, {'error': 'Webhook is disabled'}
+    elif bot_id not in {bot_store_id(token) for token in BOT_TOKENS}:
+        status, payload = 404, {'error': 'Unknown bot'}
+    elif not webhook_secret_valid(event):
+        status, payload = 403, {'error': 'Invalid secret token'}
+    else:
+        try:
+            update = json.loads(event.get('body') or '{}')
+        except json.JSONDecodeError:
+            update = None
+        if not isinstance(update, dict) or not isinstance(update.get('update_id'), int):
+            status, payload = 400, {'error': 'Invalid update'}
+        else:
+            ingest_webhook_update(bot_id, update)
+            status, payload = 200, {'ok': True}
+    
+    return {
+        'statusCode': status,
+        'headers': {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*'
+        },
+        'body': json.dumps(payload),
+        'isBase64Encoded': False
+    }
+
+def json_body(payload: Any, fields: Optional[Dict[str, Any]] = None) -> str:
+    '''Serialize response payload projected to requested fields, timed as its own stage'''
+    with stage('serialize'):
+        return dumps(project(payload, fields))
+
+def is_webhook_delivery(event: Dict[str, Any]) -> bool:
+    '''Telegram webhook deliveries are authenticated by secret token, not rate limited per IP'''
+    return bool((event.get('queryStringParameters') or {}).get('webhook')) and webhook_secret_valid(event)
+
+@instrumented('telegram-search')
+@admission_control(exempt=is_webhook_delivery)
+@compressed
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
     Business: Search via Telegram bots - send query and collect full text responses
-    Args: event - dict with httpMethod, body (phone/username)
-          context - object with request_id, function_name
+    Args: event - dict with httpMethod, body (phone/username with optional bot selector and
+                  stream flag for SSE output, or queries array for batch; optional deadline_ms);
+                  cache_first/max_age serve indexed responses, history runs full-text search over them;
+                  optional fields projection; Accept-Encoding header selects gzip/br compression;
+                  ?webhook=<bot id> marks a Telegram update delivery
+          context - object with request_id, function_name; remaining time bounds the request
     Returns: HTTP response with full text responses from both bots
     '''
     method: str = event.get('httpMethod', 'GET')
@@ -143,6 +1734,29 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'isBase64Encoded': False
         }
     
+    if method == 'GET' and (event.get('queryStringParameters') or {}).get('status'):
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Cache-Control': 'no-store',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': json.dumps({'bots': bot_health_snapshot(), 'http': get_http_stats(), 'timestamp': int(time.time())}),
+            'isBase64Encoded': False
+        }
+    
+    if method == 'GET' and (event.get('queryStringParameters') or {}).get('metrics'):
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': json.dumps(dump_metrics()),
+            'isBase64Encoded': False
+        }
+    
     if method != 'POST':
         return {
             'statusCode': 405,
@@ -154,8 +1768,77 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'isBase64Encoded': False
         }
     
+    webhook_bot = (event.get('queryStringParameters') or {}).get('webhook')
+    if webhook_bot:
+        return webhook_response(event, webhook_bot)
+    
     try:
         body_data = json.loads(event.get('body', '{}'))
+        deadline = request_deadline(context, body_data)
+        max_age = request_max_age(body_data)
+        
+        try:
+            fields = parse_fields(body_data.get('fields'))
+        except ValueError as e:
+            return {
+                'statusCode': 400,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': json.dumps({'error': str(e)}),
+                'isBase64Encoded': False
+            }
+        
+        if 'history' in body_data:
+            history_query = body_data['history']
+            if not isinstance(history_query, str) or not history_query.strip():
+                return {
+                    'statusCode': 400,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*'
+                    },
+                    'body': json.dumps({'error': 'history must be a non-empty string'}),
+                    'isBase64Encoded': False
+                }
+            
+            with stage('history'):
+                matches = search_history(history_query)
+            return {
+                'statusCode': 200,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': json_body({'success': True, 'history': matches, 'query': history_query}, fields),
+                'isBase64Encoded': False
+            }
+        
+        if 'queries' in body_data:
+            queries = body_data['queries']
+            if not isinstance(queries, list) or not queries or len(queries) > BATCH_MAX_QUERIES \
+                    or not all(isinstance(q, str) and q.strip() for q in queries):
+                return {
+                    'statusCode': 400,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*'
+                    },
+                    'body': json.dumps({'error': f'queries must be 1-{BATCH_MAX_QUERIES} non-empty strings'}),
+                    'isBase64Encoded': False
+                }
+            
+            return {
+                'statusCode': 200,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': json_body(batch_body(search_batch([q.strip() for q in queries], deadline, max_age)), fields),
+                'isBase64Encoded': False
+            }
+        
         phone_number = body_data.get('phoneNumber', '')
         username = body_data.get('username', '')
         
@@ -170,13 +1853,40 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'isBase64Encoded': False
             }
         
-        results: List[Dict[str, Any]] = []
+        bot_tokens = select_bots(body_data.get('bot'))
+        if not bot_tokens:
+            return {
+                'statusCode': 400,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': json.dumps({'error': 'Unknown bot'}),
+                'isBase64Encoded': False
+            }
+        
         search_query = username if username else phone_number
         
-        for bot_token in BOT_TOKENS:
-            bot_username = BOT_USERNAMES.get(bot_token, 'unknown')
-            bot_result = search_with_bot(bot_token, search_query, bot_username)
-            results.append(bot_result)
+        if body_data.get('stream'):
+            return {
+                'statusCode': 200,
+                'headers': {
+                    'Content-Type': 'text/event-stream',
+                    'Cache-Control': 'no-cache',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': ''.join(iter_search_events(
+                    search_query,
+                    bot_tokens,
+                    {'phoneNumber': phone_number, 'username': username},
+                    deadline,
+                    max_age,
+                    fields
+                )),
+                'isBase64Encoded': False
+            }
+        
+        results = search_all_bots(search_query, bot_tokens, deadline=deadline, max_age=max_age)
         
         return {
             'statusCode': 200,
@@ -184,15 +1894,17 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'Content-Type': 'application/json',
                 'Access-Control-Allow-Origin': '*'
             },
-            'body': json.dumps({
+            'body': json_body({
                 'success': True,
                 'results': results,
+                'partial': any(result.get('timed_out') for result in results),
+                'entities': merge_entities(results),
                 'query': {
                     'phoneNumber': phone_number,
                     'username': username
                 },
                 'timestamp': int(time.time())
-            }),
+            }, fields),
             'isBase64Encoded': False
         }
         
@@ -216,3 +1928,17 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'body': json.dumps({'error': str(e)}),
             'isBase64Encoded': False
         }
+
+def warm_up() -> None:
+    '''Do at import what lazy paths would otherwise do on the first request; no network calls'''
+    import gzip  # noqa: F401
+    import base64  # noqa: F401
+    import hmac  # noqa: F401
+    import queue  # noqa: F401
+    import random  # noqa: F401
+    import http.client  # noqa: F401
+    import concurrent.futures  # noqa: F401
+    open_update_store().close()
+
+if EAGER_INIT:
+    warm_up()
\ No newline at end of file
@@ -0,0 +1,163 @@
+'''
+Cold start: import time and first-invocation latency of each handler in a fresh interpreter
+Usage: python bench/coldstart.py [--function osint-search] [--runs 15] [--importtime 15] [--eager] [--no-bytecode]
+  Every run spawns a new Python process that imports index.py and calls the handler twice with the
+  spec that carries "coldStartBudgetMs": {"import": .., "firstInvocation": .., "total": ..}; medians are
+  compared with the budget and any excess fails the run. --importtime prints the slowest imports
+  (python -X importtime) of one extra run; --eager sets EAGER_INIT=1 to see what pre-warming moves into import;
+  --no-bytecode runs a copy of the function without __pycache__, as a deploy without compiled bytecode would.
+'''
+import argparse
+import json
+import os
+import statistics
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKEND_DIR = os.path.join(ROOT, 'backend')
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from mock_telegram import MockConfig, start_mock_server  # noqa: E402
+from run import FUNCTIONS, load_specs, make_event  # noqa: E402
+
+# Код дочернего процесса: до первого замера импортируются только sys и time
+CHILD = '''
+import sys, time
+started = time.perf_counter()
+import importlib.util
+spec = importlib.util.spec_from_file_location('coldstart_function', sys.argv[1])
+module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module)
+imported = time.perf_counter()
+import json
+
+class Context:
+    request_id = function_name = 'coldstart'
+    def get_remaining_time_in_millis(self):
+        return 30000
+
+event = json.loads(sys.argv[2])
+timings = []
+for _ in range(2):
+    t0 = time.perf_counter()
+    response = module.handler(event, Context())
+    timings.append((time.perf_counter() - t0) * 1000)
+print(json.dumps({
+    'import': (imported - started) * 1000,
+    'firstInvocation': timings[0],
+    'warmInvocation': timings[1],
+    'status': response['statusCode'],
+    'modules': len(sys.modules)
+}))
+'''
+
+def cold_start_spec(function: str) -> Optional[Dict[str, Any]]:
+    '''First spec of the function that declares a cold start budget'''
+    for spec in load_specs(function):
+        if spec.get('coldStartBudgetMs'):
+            return spec
+    return None
+
+def run_child(function_dir: str, event: Dict[str, Any], env: Dict[str, str], importtime: bool = False) -> Tuple[Dict[str, Any], str]:
+    '''One fresh interpreter; returns its timings and stderr'''
+    args = [sys.executable] + (['-X', 'importtime'] if importtime else []) + ['-c', CHILD]
+    args += [os.path.join(function_dir, 'index.py'), json.dumps(event)]
+    result = subprocess.run(args, env=env, capture_output=True, text=True, check=True)
+    timings = json.loads(result.stdout.strip().splitlines()[-1])
+    timings['total'] = timings['import'] + timings['firstInvocation']
+    return timings, result.stderr
+
+def slowest_imports(stderr: str, limit: int) -> List[Tuple[int, int, str]]:
+    '''Parse `-X importtime` output into (cumulative us, self us, module) sorted by cumulative time'''
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        rows.append((int(cumulative_us), int(self_us), name.rstrip()))
+    return sorted(rows, reverse=True)[:limit]
+
+def interpreter_baseline(runs: int) -> float:
+    '''Median wall time of an empty interpreter, the floor no handler change can go below'''
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, '-c', 'pass'], check=True)
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--function', choices=FUNCTIONS, action='append')
+    parser.add_argument('--runs', type=int, default=15)
+    parser.add_argument('--importtime', type=int, default=0, metavar='N', help='show N slowest imports')
+    parser.add_argument('--eager', action='store_true', help='run with EAGER_INIT=1')
+    parser.add_argument('--no-bytecode', action='store_true', help='compile index.py from source on every run')
+    args = parser.parse_args()
+    
+    server, base_url = start_mock_server(MockConfig())
+    store_dir = tempfile.mkdtemp(prefix='coldstart-')
+    base_env = dict(os.environ, TELEGRAM_API_BASE=base_url, TIMING_LOG='0', EAGER_INIT='1' if args.eager else '0')
+    if args.no_bytecode:
+        base_env['PYTHONDONTWRITEBYTECODE'] = '1'
+    
+    violations: List[str] = []
+    try:
+        print(f'interpreter startup: {interpreter_baseline(args.runs):.1f} ms (median, not included below)')
+        for function in args.function or FUNCTIONS:
+            spec = cold_start_spec(function)
+            if spec is None:
+                print(f'\n{function}: no spec with coldStartBudgetMs')
+                continue
+            
+            function_dir = os.path.join(BACKEND_DIR, function)
+            if args.no_bytecode:
+                function_dir = os.path.join(store_dir, function)
+                shutil.copytree(os.path.join(BACKEND_DIR, function), function_dir, ignore=shutil.ignore_patterns('__pycache__'))
+            
+            samples: Dict[str, List[float]] = {'import': [], 'firstInvocation': [], 'total': [], 'warmInvocation': []}
+            modules = 0
+            for run in range(args.runs):
+                # Каждый запуск начинается с пустого хранилища, как новый экземпляр функции
+                env = dict(base_env, UPDATE_STORE_PATH=os.path.join(store_dir, f'{function}-{run}.sqlite3'))
+                timings, _ = run_child(function_dir, make_event(spec), env)
+                if timings['status'] != spec.get('expectedStatus', timings['status']):
+                    violations.append(f'{function}: unexpected status {timings["status"]}')
+                for key in samples:
+                    samples[key].append(timings[key])
+                modules = timings['modules']
+            
+            print(f'\n{function}: {spec["name"]} ({args.runs} runs, {modules} modules loaded)')
+            print(f'  {"":18s} {"median ms":>10s} {"max ms":>8s} {"budget ms":>10s}')
+            budget = spec['coldStartBudgetMs']
+            for key, values in samples.items():
+                median = statistics.median(values)
+                limit = budget.get(key)
+                print(f'  {key:18s} {median:10.2f} {max(values):8.2f} {limit if limit is not None else "-":>10}')
+                if limit is not None and median > limit:
+                    violations.append(f'{function}: {key} {median:.2f} ms > budget {limit} ms')
+            
+            if args.importtime:
+                env = dict(base_env, UPDATE_STORE_PATH=os.path.join(store_dir, f'{function}-importtime.sqlite3'))
+                _, stderr = run_child(function_dir, make_event(spec), env, importtime=True)
+                print(f'  {"slowest imports":40s} {"cumul ms":>9s} {"self ms":>8s}')
+                for cumulative_us, self_us, name in slowest_imports(stderr, args.importtime):
+                    print(f'  {name[:40]:40s} {cumulative_us / 1000:9.2f} {self_us / 1000:8.2f}')
+    finally:
+        server.shutdown()
+        shutil.rmtree(store_dir, ignore_errors=True)
+    
+    if violations:
+        print('\nCold start budget violations:')
+        for violation in violations:
+            print(f'  {violation}')
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
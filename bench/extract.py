@@ -0,0 +1,96 @@
+'''
+Benchmark: single-pass entity extraction from large bot responses
+Usage: python bench/extract.py [--sizes-mb 1 2 4 8] [--tolerance 1.5]
+  Exits with status 1 if time per MB on the largest input exceeds the smallest one by more than tolerance
+'''
+import argparse
+import importlib.util
+import os
+import random
+import sys
+import time
+from typing import Any, Callable, Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TELEGRAM_SEARCH = os.path.join(ROOT, 'backend', 'telegram-search', 'index.py')
+
+RECORD = (
+    'ФИО: {last} {first} Иванович\n'
+    'Телефон: +7 (9{n:02d}) 123-45-{n:02d}, 8 9{n:02d} 765 43 21\n'
+    'Email: user{n}@mail.ru\n'
+    'Дата рождения: {n:02d}.05.1990\n'
+    'Адрес: г. Москва, ул. Ленина, д. {n}\n'
+    'Профиль: https://vk.com/id{n}{k} t.me/user{n}\n'
+    'ИНН 77070838{n:02d} паспорт 4510 1234{n:02d}\n\n'
+)
+LAST_NAMES = ('Иванов', 'Петров', 'Сидоров', 'Кузнецов')
+FIRST_NAMES = ('Иван', 'Пётр', 'Сергей', 'Алексей')
+
+def load_module(name: str, path: str) -> Any:
+    '''Import module from file path without touching sys.path'''
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def realistic_text(size: int) -> str:
+    '''Bot dump of repeated profile records with overlapping entities'''
+    rng = random.Random(size)
+    parts: List[str] = []
+    total = 0
+    k = 0
+    while total < size:
+        record = RECORD.format(last=rng.choice(LAST_NAMES), first=rng.choice(FIRST_NAMES), n=rng.randrange(100), k=k)
+        parts.append(record)
+        total += len(record.encode('utf-8'))
+        k += 1
+    return ''.join(parts)
+
+# Входы, на которых неограниченные повторы дали бы квадратичное время
+ADVERSARIAL: Dict[str, Callable[[int], str]] = {
+    'word run': lambda size: 'a' * size,
+    'digit run': lambda size: '1' * size,
+    'dots and at': lambda size: ('a.' * (size // 2)) + '@',
+    'separators': lambda size: '7 ' * (size // 2),
+    'no newline label': lambda size: 'Адрес: ' + 'x' * size,
+}
+
+def time_extract(extract: Callable[[str], Any], text: str) -> float:
+    '''Best-of-3 seconds for one extraction'''
+    best = float('inf')
+    for _ in range(3):
+        start = time.perf_counter()
+        extract(text)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes-mb', type=float, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--tolerance', type=float, default=1.5)
+    args = parser.parse_args()
+    
+    os.environ.setdefault('TIMING_LOG', '0')
+    extract = load_module('bench_telegram_search', TELEGRAM_SEARCH).extract_entities
+    
+    inputs: Dict[str, Callable[[int], str]] = {'realistic dump': realistic_text, **ADVERSARIAL}
+    failures: List[str] = []
+    print(f'{"input":20s} {"MB":>6s} {"ms":>9s} {"MB/s":>8s} {"entities":>9s}')
+    for name, make_text in inputs.items():
+        per_mb = []
+        for size_mb in args.sizes_mb:
+            text = make_text(int(size_mb * 1024 * 1024))
+            seconds = time_extract(extract, text)
+            entities = sum(len(values) for values in extract(text).values())
+            per_mb.append(seconds / size_mb)
+            print(f'{name:20s} {size_mb:6.1f} {seconds * 1000:9.1f} {size_mb / seconds:8.1f} {entities:9d}')
+        growth = per_mb[-1] / per_mb[0]
+        if growth > args.tolerance:
+            failures.append(f'{name}: time per MB grew {growth:.2f}x from {args.sizes_mb[0]} to {args.sizes_mb[-1]} MB')
+    
+    for failure in failures:
+        print(f'NON-LINEAR {failure}')
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,128 @@
+'''
+Load test: telegram-search under overload with and without admission control
+Usage: python bench/load.py [--clients 8 32 128] [--duration 3] [--capacity 4] [--latency-ms 10] [--stability 2]
+  Closed-loop clients with distinct IPs search unique usernames against a mock Bot API that serves only
+  `capacity` calls at once; shed clients wait Retry-After. The first client count should already saturate
+  MAX_IN_FLIGHT. Exits with status 1 if, with admission control, p99 of admitted requests at the highest
+  client count exceeds `stability` times p99 at the first one.
+'''
+import argparse
+import importlib.util
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TELEGRAM_SEARCH = os.path.join(ROOT, 'backend', 'telegram-search', 'index.py')
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from mock_telegram import MockConfig, start_mock_server  # noqa: E402
+from run import BenchContext, percentile  # noqa: E402
+
+# Лимит на клиента не мешает: перегрузку создаёт число клиентов, а не частота запросов каждого
+CLIENT_LIMITS = {'ADMISSION_RATE': '1000000', 'ADMISSION_BURST': '1000000'}
+MODES = {
+    # Без допуска: все запросы сразу идут к Bot API
+    'unlimited': {**CLIENT_LIMITS, 'MAX_IN_FLIGHT': '100000', 'ADMISSION_QUEUE': '0'},
+    'admission': CLIENT_LIMITS,
+}
+
+def load_handler(mode: str, env: Dict[str, str], store_dir: str) -> Any:
+    '''Import a fresh telegram-search module configured for the mode'''
+    os.environ.update(env)
+    os.environ['UPDATE_STORE_PATH'] = os.path.join(store_dir, f'{mode}.sqlite3')
+    spec = importlib.util.spec_from_file_location(f'load_telegram_search_{mode}', TELEGRAM_SEARCH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    for key in env:
+        del os.environ[key]
+    return module.handler
+
+def run_clients(handler: Any, clients: int, duration: float, run_id: str) -> Dict[str, Any]:
+    '''Closed loop: each client sends its next request as soon as the previous one returns'''
+    samples: List[tuple] = []
+    lock = threading.Lock()
+    stop_at = time.monotonic() + duration
+    
+    def client(number: int) -> None:
+        sequence = 0
+        while time.monotonic() < stop_at:
+            event = {
+                'httpMethod': 'POST',
+                'headers': {},
+                'queryStringParameters': {},
+                'body': json.dumps({'username': f'@load_{run_id}_{number}_{sequence}'}),
+                'requestContext': {'identity': {'sourceIp': f'10.0.{number // 250}.{number % 250}'}}
+            }
+            started = time.perf_counter()
+            response = handler(event, BenchContext(budget_ms=5000))
+            elapsed = (time.perf_counter() - started) * 1000
+            with lock:
+                samples.append((response['statusCode'], elapsed))
+            sequence += 1
+            retry_after = (response.get('headers') or {}).get('Retry-After')
+            if retry_after:
+                time.sleep(max(0.0, min(float(retry_after), stop_at - time.monotonic())))
+    
+    threads = [threading.Thread(target=client, args=(number,)) for number in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    ok = [elapsed for status, elapsed in samples if status == 200]
+    shed = [elapsed for status, elapsed in samples if status in (429, 503)]
+    return {
+        'clients': clients,
+        'ok': len(ok),
+        'shed': len(shed),
+        'ok_rps': len(ok) / duration,
+        'p50': percentile(ok, 50) if ok else float('nan'),
+        'p99': percentile(ok, 99) if ok else float('nan'),
+        'shed_p99': percentile(shed, 99) if shed else 0.0,
+        'mean': statistics.fmean(ok) if ok else float('nan')
+    }
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, nargs='+', default=[8, 32, 128])
+    parser.add_argument('--duration', type=float, default=3)
+    parser.add_argument('--capacity', type=int, default=4, help='Bot API calls the mock serves at once')
+    parser.add_argument('--latency-ms', type=float, default=10)
+    parser.add_argument('--stability', type=float, default=2)
+    args = parser.parse_args()
+    
+    config = MockConfig(latency_ms=args.latency_ms, capacity=args.capacity)
+    server, base_url = start_mock_server(config)
+    store_dir = tempfile.mkdtemp(prefix='load-')
+    os.environ['TELEGRAM_API_BASE'] = base_url
+    os.environ.setdefault('TIMING_LOG', '0')
+    
+    admission_p99: List[float] = []
+    try:
+        for mode, env in MODES.items():
+            handler = load_handler(mode, env, store_dir)
+            print(f'\n{mode}')
+            print(f'  {"clients":>7s} {"ok":>6s} {"shed":>6s} {"ok/s":>7s} {"p50 ms":>8s} {"p99 ms":>8s} {"shed p99":>9s}')
+            for clients in args.clients:
+                stats = run_clients(handler, clients, args.duration, f'{mode}{clients}')
+                print(
+                    f'  {stats["clients"]:7d} {stats["ok"]:6d} {stats["shed"]:6d} {stats["ok_rps"]:7.1f} '
+                    f'{stats["p50"]:8.1f} {stats["p99"]:8.1f} {stats["shed_p99"]:9.2f}'
+                )
+                if mode == 'admission':
+                    admission_p99.append(stats['p99'])
+    finally:
+        server.shutdown()
+    
+    growth = admission_p99[-1] / admission_p99[0]
+    print(f'\nadmitted p99 grew {growth:.2f}x from {args.clients[0]} to {args.clients[-1]} clients (limit {args.stability}x)')
+    return 0 if growth <= args.stability else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
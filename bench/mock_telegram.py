@@ -0,0 +1,165 @@
+'''
+Local mock of the Telegram Bot API (getMe, getUpdates, sendMessage) for benchmarks
+Usage: python bench/mock_telegram.py [--port 8081] [--latency-ms 20] [--rate-limit-every 10] [--error-rate 0.05] [--capacity 4]
+Point telegram-search at it with TELEGRAM_API_BASE=http://127.0.0.1:<port>
+'''
+import argparse
+import json
+import random
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+
+class MockConfig:
+    '''Fault and latency injection knobs, mutable while the server runs'''
+    def __init__(
+        self,
+        latency_ms: float = 0,
+        rate_limit_every: int = 0,
+        retry_after: int = 1,
+        error_rate: float = 0,
+        long_poll_cap_ms: float = 0,
+        capacity: int = 0
+    ) -> None:
+        self.latency_ms = latency_ms
+        self.rate_limit_every = rate_limit_every
+        self.retry_after = retry_after
+        self.error_rate = error_rate
+        self.long_poll_cap_ms = long_poll_cap_ms
+        # capacity > 0 — сколько запросов мок обслуживает одновременно, остальные ждут, как у перегруженного API
+        self.capacity = threading.BoundedSemaphore(capacity) if capacity else None
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.calls: Dict[str, int] = {}
+        self.updates: Dict[str, List[Dict[str, Any]]] = {}
+        self.next_update_id = 1
+    
+    def add_message(self, bot_id: str, chat_id: int, text: str, reply_to: Optional[int] = None) -> int:
+        '''Queue incoming text message for bot; returns message_id'''
+        with self.lock:
+            update_id = self.next_update_id
+            self.next_update_id += 1
+            message: Dict[str, Any] = {
+                'message_id': update_id,
+                'chat': {'id': chat_id, 'type': 'private'},
+                'date': int(time.time()),
+                'text': text
+            }
+            if reply_to is not None:
+                message['reply_to_message'] = {'message_id': reply_to}
+            self.updates.setdefault(bot_id, []).append({'update_id': update_id, 'message': message})
+            return update_id
+
+def make_handler(config: MockConfig) -> type:
+    class MockTelegramHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        # Заголовки и тело уходят отдельными write; с Nagle клиент ждёт delayed ACK ~40 мс на каждый ответ
+        disable_nagle_algorithm = True
+        
+        def log_message(self, *args: Any) -> None:
+            pass
+        
+        def reply(self, status: int, payload: Dict[str, Any]) -> None:
+            body = json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        
+        def route(self) -> Tuple[str, str, Dict[str, Any]]:
+            parts = urllib.parse.urlsplit(self.path)
+            segments = parts.path.strip('/').split('/')
+            token = segments[-2][3:] if len(segments) >= 2 and segments[-2].startswith('bot') else ''
+            params: Dict[str, Any] = dict(urllib.parse.parse_qsl(parts.query))
+            length = int(self.headers.get('Content-Length') or 0)
+            if length:
+                params.update(json.loads(self.rfile.read(length) or b'{}'))
+            return token, segments[-1], params
+        
+        def handle_api(self) -> None:
+            token, method, params = self.route()
+            bot_id = token.split(':', 1)[0]
+            
+            with config.lock:
+                config.requests += 1
+                config.calls[method] = config.calls.get(method, 0) + 1
+                request_number = config.requests
+            
+            if config.latency_ms:
+                if config.capacity:
+                    with config.capacity:
+                        time.sleep(config.latency_ms / 1000)
+                else:
+                    time.sleep(config.latency_ms / 1000)
+            
+            if config.rate_limit_every and request_number % config.rate_limit_every == 0:
+                return self.reply(429, {
+                    'ok': False,
+                    'error_code': 429,
+                    'description': f'Too Many Requests: retry after {config.retry_after}',
+                    'parameters': {'retry_after': config.retry_after}
+                })
+            if config.error_rate and random.random() < config.error_rate:
+                return self.reply(500, {'ok': False, 'error_code': 500, 'description': 'Internal Server Error'})
+            
+            if method == 'getMe':
+                return self.reply(200, {
+                    'ok': True,
+                    'result': {'id': int(bot_id or 0), 'is_bot': True, 'first_name': 'Mock', 'username': f'mock_{bot_id}_bot'}
+                })
+            if method == 'sendMessage':
+                return self.reply(200, {
+                    'ok': True,
+                    'result': {'message_id': 1, 'chat': {'id': params.get('chat_id')}, 'text': params.get('text', '')}
+                })
+            if method == 'getUpdates':
+                offset = int(params.get('offset', 0))
+                limit = int(params.get('limit', 100))
+                with config.lock:
+                    queue = [u for u in config.updates.get(bot_id, []) if u['update_id'] >= offset]
+                    config.updates[bot_id] = queue
+                if not queue and config.long_poll_cap_ms:
+                    time.sleep(min(float(params.get('timeout', 0)) * 1000, config.long_poll_cap_ms) / 1000)
+                return self.reply(200, {'ok': True, 'result': queue[:limit]})
+            
+            return self.reply(404, {'ok': False, 'error_code': 404, 'description': 'Not Found'})
+        
+        do_GET = handle_api
+        do_POST = handle_api
+    
+    return MockTelegramHandler
+
+def start_mock_server(config: MockConfig, port: int = 0) -> Tuple[ThreadingHTTPServer, str]:
+    '''Start mock in a background thread
+    Returns: (server, base url for TELEGRAM_API_BASE)
+    '''
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(config))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}'
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency-ms', type=float, default=0)
+    parser.add_argument('--rate-limit-every', type=int, default=0)
+    parser.add_argument('--retry-after', type=int, default=1)
+    parser.add_argument('--error-rate', type=float, default=0)
+    parser.add_argument('--long-poll-cap-ms', type=float, default=0)
+    parser.add_argument('--capacity', type=int, default=0, help='requests served concurrently, 0 = unlimited')
+    args = parser.parse_args()
+    
+    config = MockConfig(args.latency_ms, args.rate_limit_every, args.retry_after, args.error_rate, args.long_poll_cap_ms, args.capacity)
+    server, base_url = start_mock_server(config, args.port)
+    print(f'Mock Telegram Bot API on {base_url}')
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == '__main__':
+    main()
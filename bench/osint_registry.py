@@ -0,0 +1,112 @@
+'''
+Benchmark: per-request cost of building osint-search source lists
+Usage: python bench/osint_registry.py [--baseline GIT_REV] [--iterations N]
+  --baseline - also time the legacy per-request dict construction from GIT_REV
+'''
+import argparse
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+OSINT_DIR = os.path.join(ROOT, 'backend', 'osint-search')
+
+PHONE = '+7 999 123-45-67'
+USERNAME = '@madefferg'
+
+def load_module(name: str, path: str) -> Any:
+    '''Import module from file path without touching sys.path'''
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def time_per_call(fn: Callable[[], Any], iterations: int) -> float:
+    '''Best-of-5 mean time per call in microseconds'''
+    best = float('inf')
+    for _ in range(5):
+        start = time.perf_counter()
+        for _ in range(iterations):
+            fn()
+        best = min(best, (time.perf_counter() - start) / iterations)
+    return best * 1e6
+
+def synthetic_registry(base: Dict[str, Any], copies: int) -> Dict[str, Any]:
+    '''Registry with every category repeated `copies` times'''
+    return {
+        search_type: {group: categories * copies for group, categories in groups.items()}
+        for search_type, groups in base.items()
+    }
+
+def count_sources(registry: Dict[str, Any], search_type: str) -> int:
+    return sum(len(c['sources']) for groups in registry[search_type].values() for c in groups)
+
+def bench_baseline(rev: str, iterations: int) -> None:
+    '''Time legacy search_* functions from a git revision'''
+    source = subprocess.run(
+        ['git', 'show', f'{rev}:backend/osint-search/index.py'],
+        cwd=ROOT, capture_output=True, text=True, check=True
+    ).stdout
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'legacy_index.py')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(source)
+        legacy = load_module('legacy_index', path)
+    
+    phone_us = time_per_call(
+        lambda: legacy.search_phone_osint(PHONE) + legacy.search_phone_closed_sources(PHONE), iterations
+    )
+    username_us = time_per_call(
+        lambda: legacy.search_username_osint(USERNAME) + legacy.search_username_closed_sources(USERNAME), iterations
+    )
+    print(f'baseline {rev}: phone {phone_us:.1f} us/request, username {username_us:.1f} us/request')
+
+def bench_registry(iterations: int) -> None:
+    '''Time registry rendering for the bundled registry and for scaled-up copies'''
+    index = load_module('osint_index', os.path.join(OSINT_DIR, 'index.py'))
+    with open(index.SOURCES_PATH, encoding='utf-8') as f:
+        base = json.load(f)
+    
+    phone_us = time_per_call(lambda: index.build_sources('phone', PHONE), iterations)
+    username_us = time_per_call(lambda: index.build_sources('username', USERNAME), iterations)
+    print(f'registry: phone {phone_us:.1f} us/request, username {username_us:.1f} us/request')
+    
+    print('scaling (username):')
+    rows: List[str] = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for copies in (1, 10, 100):
+            path = os.path.join(tmp, f'sources_{copies}.json')
+            registry = synthetic_registry(base, copies)
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(registry, f, ensure_ascii=False)
+            
+            start = time.perf_counter()
+            compiled = index.load_registry(path)
+            load_ms = (time.perf_counter() - start) * 1000
+            
+            index.SOURCE_RENDERERS = compiled
+            per_request = time_per_call(lambda: index.build_sources('username', USERNAME), max(1, iterations // copies))
+            sources = count_sources(registry, 'username')
+            rows.append(
+                f'  {sources:6d} sources: {per_request:9.1f} us/request, '
+                f'{per_request / sources:.3f} us/source, import-time compile {load_ms:.1f} ms'
+            )
+    print('\n'.join(rows))
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--baseline', help='git revision with legacy search_* functions')
+    parser.add_argument('--iterations', type=int, default=2000)
+    args = parser.parse_args()
+    
+    if args.baseline:
+        bench_baseline(args.baseline, args.iterations)
+    bench_registry(args.iterations)
+
+if __name__ == '__main__':
+    sys.exit(main())
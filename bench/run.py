@@ -0,0 +1,191 @@
+'''
+Benchmark harness: drives backend handlers in-process using their tests.json specs
+Usage: python bench/run.py [--function osint-search] [--iterations 200] [--latency-ms 5]
+                           [--rate-limit-every 0] [--error-rate 0] [--long-poll-cap-ms 100]
+telegram-search talks to a local mock Bot API (bench/mock_telegram.py), never to api.telegram.org.
+The mock holds an empty getUpdates long poll for up to --long-poll-cap-ms, as Telegram does while a bot
+has not answered yet; --long-poll-cap-ms 0 measures only the path where updates are already queued.
+A test spec may carry "latencyBudgetMs": {"p50": .., "p95": .., "p99": ..}; exceeding it fails the run.
+Specs with "skipBenchmark": true (e.g. ones that need the internet) are skipped.
+Responses are checked against expectedStatus, expectedHeaders and expectedIsBase64Encoded; a response with an
+ETag is replayed once with If-None-Match and must come back 304.
+'''
+import argparse
+import importlib.util
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Dict, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKEND_DIR = os.path.join(ROOT, 'backend')
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from mock_telegram import MockConfig, start_mock_server  # noqa: E402
+
+FUNCTIONS = ('osint-search', 'telegram-search')
+
+class BenchContext:
+    '''Minimal stand-in for the platform invocation context'''
+    def __init__(self, budget_ms: int = 30000) -> None:
+        self.request_id = 'bench'
+        self.function_name = 'bench'
+        self.budget_ms = budget_ms
+    
+    def get_remaining_time_in_millis(self) -> int:
+        return self.budget_ms
+
+def load_handler(function: str) -> Any:
+    '''Import function's index.py under a unique module name'''
+    path = os.path.join(BACKEND_DIR, function, 'index.py')
+    spec = importlib.util.spec_from_file_location(f'bench_{function.replace("-", "_")}', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.handler
+
+def load_specs(function: str) -> List[Dict[str, Any]]:
+    with open(os.path.join(BACKEND_DIR, function, 'tests.json'), encoding='utf-8') as f:
+        return json.load(f)['tests']
+
+def make_event(spec: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        'httpMethod': spec.get('method', 'GET'),
+        'path': spec.get('path', '/'),
+        'headers': spec.get('headers', {}),
+        'queryStringParameters': spec.get('query', {}),
+        'body': json.dumps(spec['body']) if 'body' in spec else '',
+        'isBase64Encoded': False,
+        'requestContext': {'identity': {'sourceIp': '127.0.0.1'}}
+    }
+
+def percentile(samples: List[float], q: float) -> float:
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(q / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+def check_revalidation(handler: Any, event: Dict[str, Any]) -> Optional[bool]:
+    '''Send the ETag of a first response back as If-None-Match
+    Returns: None if the response has no ETag, otherwise whether the replay got 304
+    '''
+    etag = (handler(event, BenchContext()).get('headers') or {}).get('ETag')
+    if not etag:
+        return None
+    revalidation = dict(event, headers=dict(event['headers'], **{'If-None-Match': etag}))
+    return handler(revalidation, BenchContext()).get('statusCode') == 304
+
+def run_spec(handler: Any, spec: Dict[str, Any], iterations: int, warmup: int) -> Dict[str, Any]:
+    '''Time one spec; memory is measured on separate traced runs so it does not skew latency'''
+    event = make_event(spec)
+    expected_status = spec.get('expectedStatus')
+    expected_headers = spec.get('expectedHeaders') or {}
+    expected_base64 = spec.get('expectedIsBase64Encoded')
+    status_errors = 0
+    
+    for _ in range(warmup):
+        handler(event, BenchContext())
+    revalidated = check_revalidation(handler, event) if expected_status == 200 else None
+    
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(iterations):
+        t0 = time.perf_counter()
+        response = handler(event, BenchContext())
+        latencies.append((time.perf_counter() - t0) * 1000)
+        if expected_status is not None and response.get('statusCode') != expected_status:
+            status_errors += 1
+        elif any((response.get('headers') or {}).get(key) != value for key, value in expected_headers.items()):
+            status_errors += 1
+        elif expected_base64 is not None and bool(response.get('isBase64Encoded')) != expected_base64:
+            status_errors += 1
+    elapsed = time.perf_counter() - started
+    
+    traced_runs = max(1, min(20, iterations // 10))
+    tracemalloc.start()
+    peaks = []
+    for _ in range(traced_runs):
+        tracemalloc.reset_peak()
+        baseline, _ = tracemalloc.get_traced_memory()
+        handler(event, BenchContext())
+        _, peak = tracemalloc.get_traced_memory()
+        peaks.append(peak - baseline)
+    tracemalloc.stop()
+    
+    return {
+        'name': spec.get('name', ''),
+        'iterations': iterations,
+        'p50': percentile(latencies, 50),
+        'p95': percentile(latencies, 95),
+        'p99': percentile(latencies, 99),
+        'mean': statistics.fmean(latencies),
+        'rps': iterations / elapsed if elapsed else float('inf'),
+        'peak_kib': statistics.fmean(peaks) / 1024,
+        'status_errors': status_errors,
+        'revalidated': revalidated
+    }
+
+def check_budget(spec: Dict[str, Any], stats: Dict[str, Any]) -> List[str]:
+    '''Compare percentiles with spec latency budget; returns violations'''
+    violations = []
+    for key, limit in (spec.get('latencyBudgetMs') or {}).items():
+        if key in stats and stats[key] > limit:
+            violations.append(f'{stats["name"]}: {key} {stats[key]:.2f} ms > budget {limit} ms')
+    if stats['status_errors']:
+        violations.append(f'{stats["name"]}: {stats["status_errors"]} responses with unexpected status, headers or encoding')
+    if stats['revalidated'] is False:
+        violations.append(f'{stats["name"]}: If-None-Match with the response ETag did not return 304')
+    return violations
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--function', choices=FUNCTIONS, action='append')
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--latency-ms', type=float, default=0, help='mock Bot API latency per call')
+    parser.add_argument('--rate-limit-every', type=int, default=0, help='mock answers 429 on every Nth call')
+    parser.add_argument('--error-rate', type=float, default=0, help='share of mock calls failing with 500')
+    parser.add_argument('--long-poll-cap-ms', type=float, default=100, help='longest wait of an empty getUpdates long poll')
+    args = parser.parse_args()
+    
+    config = MockConfig(args.latency_ms, args.rate_limit_every, 0, args.error_rate, args.long_poll_cap_ms)
+    server, base_url = start_mock_server(config)
+    store_dir = tempfile.mkdtemp(prefix='bench-')
+    os.environ['TELEGRAM_API_BASE'] = base_url
+    os.environ['UPDATE_STORE_PATH'] = os.path.join(store_dir, 'updates.sqlite3')
+    # Одна строка лога на вызов засоряет вывод и искажает замеры
+    os.environ.setdefault('TIMING_LOG', '0')
+    # Все спеки идут с одного IP подряд; лимиты допуска проверяет bench/load.py
+    os.environ.setdefault('ADMISSION_RATE', '1000000')
+    os.environ.setdefault('ADMISSION_BURST', '1000000')
+    
+    violations: List[str] = []
+    try:
+        for function in args.function or FUNCTIONS:
+            handler = load_handler(function)
+            print(f'\n{function}')
+            print(f'  {"test":40s} {"p50 ms":>8s} {"p95 ms":>8s} {"p99 ms":>8s} {"req/s":>9s} {"peak KiB":>9s}')
+            for spec in load_specs(function):
+                if spec.get('skipBenchmark'):
+                    continue
+                stats = run_spec(handler, spec, args.iterations, args.warmup)
+                print(
+                    f'  {stats["name"][:40]:40s} {stats["p50"]:8.2f} {stats["p95"]:8.2f} {stats["p99"]:8.2f} '
+                    f'{stats["rps"]:9.0f} {stats["peak_kib"]:9.1f}'
+                )
+                violations.extend(check_budget(spec, stats))
+        print(f'\nmock Bot API calls: {config.calls}')
+    finally:
+        server.shutdown()
+    
+    if violations:
+        print('\nLatency budget violations:')
+        for violation in violations:
+            print(f'  {violation}')
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
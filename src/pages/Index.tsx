@@ -1,4 +1,4 @@
-import { useState } from 'react';
+import { useRef, useState } from 'react';
 import { Input } from '@/components/ui/input';
 import { Button } from '@/components/ui/button';
 import { Card } from '@/components/ui/card';
@@ -24,12 +24,39 @@ interface OsintResult {
   timestamp: number;
 }
 
+interface BotResult {
+  source: string;
+  description: string;
+  query: string;
+  found: boolean;
+  error?: string;
+  response_text: string;
+  entities?: Record<string, string[]>;
+}
+
+const ENTITY_LABELS: Record<string, string> = {
+  phones: 'Телефоны',
+  emails: 'Email',
+  names: 'ФИО',
+  addresses: 'Адреса',
+  dates: 'Даты',
+  links: 'Ссылки',
+};
+
+const TELEGRAM_SEARCH_URL = 'https://functions.poehali.dev/05fb67f4-e315-4696-9660-751f59dcdd23';
+const TELEGRAM_BOTS = ['Free_Botyara_Bot', 'VEKTOR_MPFey_Robot'];
+
 export default function Index() {
   const [phoneNumber, setPhoneNumber] = useState('');
   const [username, setUsername] = useState('');
   const [isSearching, setIsSearching] = useState(false);
   const [searchResults, setSearchResults] = useState<OsintResult | null>(null);
   const [searchHistory, setSearchHistory] = useState<OsintResult[]>([]);
+  const responseCache = useRef(new Map<string, { etag: string; data: OsintResult }>());
+  const [botResults, setBotResults] = useState<BotResult[]>([]);
+  const [isBotSearching, setIsBotSearching] = useState(false);
+  const botStream = useRef<AbortController | null>(null);
+  const botResultsCache = useRef(new Map<string, BotResult[]>());
   const { toast } = useToast();
 
   const validatePhoneNumber = (phone: string): boolean => {
@@ -42,6 +69,54 @@ export default function Index() {
     return usernameRegex.test(user);
   };
 
+  const searchBots = async (phone: string, user: string, cacheKey: string) => {
+    // Новый поиск обрывает запросы предыдущего, иначе его результаты попадут в чужую карточку
+    botStream.current?.abort();
+    const controller = new AbortController();
+    botStream.current = controller;
+    const collected: BotResult[] = [];
+
+    setBotResults([]);
+    setIsBotSearching(true);
+
+    // Среда выполнения отдаёт тело ответа целиком, поэтому каждый бот — отдельный запрос:
+    // результат показывается, как только ответил его бот, не дожидаясь самого медленного
+    const searchBot = async (bot: string) => {
+      try {
+        const response = await fetch(TELEGRAM_SEARCH_URL, {
+          method: 'POST',
+          headers: {
+            'Content-Type': 'application/json',
+          },
+          body: JSON.stringify({ phoneNumber: phone, username: user, bot }),
+          signal: controller.signal,
+        });
+
+        if (!response.ok) {
+          return;
+        }
+
+        const { results } = await response.json();
+        if (!controller.signal.aborted && results) {
+          collected.push(...results);
+          setBotResults((prev) => [...prev, ...results]);
+        }
+      } catch {
+        // Результаты ботов дополнительные, ошибка не должна мешать основному поиску
+      }
+    };
+
+    await Promise.all(TELEGRAM_BOTS.map(searchBot));
+
+    if (!controller.signal.aborted) {
+      botResultsCache.current.set(cacheKey, collected);
+    }
+    if (botStream.current === controller) {
+      botStream.current = null;
+      setIsBotSearching(false);
+    }
+  };
+
   const handleSearch = async () => {
     if (!phoneNumber && !username) {
       toast({
@@ -70,27 +145,53 @@ export default function Index() {
       return;
     }
 
+    botStream.current?.abort();
     setIsSearching(true);
     
     try {
+      const requestBody = JSON.stringify({
+        phoneNumber: phoneNumber,
+        username: username,
+      });
+      const cached = responseCache.current.get(requestBody);
+
       const response = await fetch('https://functions.poehali.dev/3f7cbc30-5359-4fd6-8f27-b0aff8e54dd6', {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
+          ...(cached ? { 'If-None-Match': cached.etag } : {}),
         },
-        body: JSON.stringify({
-          phoneNumber: phoneNumber,
-          username: username,
-        }),
+        body: requestBody,
       });
 
-      const data = await response.json();
+      let data: OsintResult;
+      const notModified = response.status === 304 && cached !== undefined;
 
-      if (!response.ok) {
-        throw new Error(data.error || 'Ошибка при поиске');
+      if (notModified) {
+        data = { ...cached.data, timestamp: Math.floor(Date.now() / 1000) };
+      } else {
+        const json = await response.json();
+
+        if (!response.ok) {
+          throw new Error(json.error || 'Ошибка при поиске');
+        }
+
+        data = json;
+
+        const etag = response.headers.get('ETag');
+        if (etag) {
+          responseCache.current.set(requestBody, { etag, data });
+        }
       }
 
       if (data.success && data.sources) {
+        // Ответ не изменился — показываем сохранённые результаты ботов вместо нового поиска в Telegram
+        const cachedBotResults = botResultsCache.current.get(requestBody);
+        if (notModified && cachedBotResults) {
+          setBotResults(cachedBotResults);
+        } else {
+          searchBots(phoneNumber, username, requestBody);
+        }
         setSearchResults(data);
         setSearchHistory(prev => [data, ...prev]);
         toast({
@@ -255,6 +356,48 @@ export default function Index() {
                 </div>
               </Card>
             ))}
+
+            {(isBotSearching || botResults.length > 0) && (
+              <Card className="p-4 md:p-6 lg:p-8 shadow-lg border-2 animate-scale-in">
+                <div className="space-y-3 md:space-y-4">
+                  <div className="flex items-start gap-3">
+                    <div className="p-2 md:p-3 bg-gradient-to-br from-primary/20 to-secondary/20 rounded-xl flex-shrink-0">
+                      <Icon name="Bot" size={24} className="text-primary md:w-7 md:h-7" />
+                    </div>
+                    <div className="flex-1 min-w-0 flex items-center gap-2">
+                      <h3 className="font-bold text-lg md:text-xl">Telegram-боты</h3>
+                      {isBotSearching && <Icon name="Loader2" size={18} className="animate-spin text-muted-foreground" />}
+                    </div>
+                  </div>
+
+                  <div className="bg-muted/30 rounded-lg p-3 md:p-5 space-y-2 md:space-y-3">
+                    {botResults.map((bot, botIdx) => (
+                      <div key={botIdx} className="p-2 md:p-3 bg-background rounded-md border border-border animate-fade-in">
+                        <div className="flex items-center justify-between gap-2 mb-0.5 md:mb-1">
+                          <span className="text-xs font-medium text-muted-foreground uppercase tracking-wide truncate">{bot.source}</span>
+                          <span className={`text-xs font-semibold flex-shrink-0 ${bot.found ? 'text-primary' : 'text-muted-foreground'}`}>
+                            {bot.found ? 'Найдено' : bot.error ? 'Ошибка' : 'Нет ответа'}
+                          </span>
+                        </div>
+                        {bot.entities && Object.keys(bot.entities).length > 0 && (
+                          <div className="space-y-1 mb-2">
+                            {Object.entries(bot.entities).map(([kind, values]) => (
+                              <div key={kind} className="flex flex-wrap items-center gap-1">
+                                <span className="text-xs text-muted-foreground">{ENTITY_LABELS[kind] || kind}:</span>
+                                {values.map((value) => (
+                                  <span key={value} className="text-xs px-1.5 py-0.5 bg-primary/10 text-primary rounded break-all">{value}</span>
+                                ))}
+                              </div>
+                            ))}
+                          </div>
+                        )}
+                        <p className="text-xs md:text-sm text-foreground whitespace-pre-wrap break-words">{bot.error || bot.response_text}</p>
+                      </div>
+                    ))}
+                  </div>
+                </div>
+              </Card>
+            )}
           </div>
         )}
 